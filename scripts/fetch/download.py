@@ -16,10 +16,11 @@ from scripts.queries import (
 from scripts.utils import (
     country_code2region, get_date_parts, get_event_directory,
     read_users_jsonl, read_set, read_tournaments_jsonl,
-    write_json, extend_jsonl, write_jsonl,
-    set_indent_num, set_page_delay,
+    write_json, write_json_records, extend_jsonl, write_jsonl,
+    submit_write, wait_for_pending_writes,
+    set_indent_num, set_page_delay, set_page_prefetch,
     fetch_data_with_retries, fetch_all_nodes,
-    set_retry_parameters, set_api_parameters,
+    set_retry_parameters, set_api_parameters, enable_response_cache,
     FetchError, NoPhaseError,
 )
 
@@ -107,11 +108,16 @@ def main():
         action="store_true",
         help="Refresh only matches.json for existing event directories. Skip standings, seeds, attr, and user updates.",
     )
+    parser.add_argument("--page_prefetch", type=int, default=1, help="Number of result pages fetched in parallel once the page count is known (1 fetches pages one by one)")
+    parser.add_argument("--cache_dir", default=None, help="Directory for cached start.gg responses (disabled when omitted)")
+    parser.add_argument("--cache_ttl", type=float, default=3600.0, help="Seconds a cached start.gg response stays valid")
     args = parser.parse_args()
 
     set_indent_num(args.indent_num)
     configure_fetch_behavior(args)
+    set_page_prefetch(args.page_prefetch)
     set_api_parameters(args.url, args.token)
+    enable_response_cache(args.cache_dir, args.cache_ttl)
     if args.start_date is not None and args.start_date < args.finish_date:
         raise ValueError("--start_date must be greater than or equal to --finish_date.")
 
@@ -232,6 +238,7 @@ def download_all_tournaments(
 
                 if tournament_dt < finish_date:
                     print("!!!downloaded all!!!")
+                    wait_for_pending_writes()
                     return
 
                 if tournament_id in tournaments:
@@ -264,6 +271,7 @@ def download_all_tournaments(
                         entrant2user = fetch_entrant_user_map(event_id)
                         download_all_set(event_id, entrant2user, event_dir, lightweight=True)
                     else:
+                        os.makedirs(event_dir, exist_ok=True)
                         user_data, player_data, entrant2user = download_standings(event_id, event_dir)
                         num_entrants = len(user_data)
                         try:
@@ -291,6 +299,7 @@ def download_all_tournaments(
                         if tournament_id in existing_tournament_ids:
                             rewrite_tournaments = True
                 # ファイルを保存
+                wait_for_pending_writes()
                 if len(tournaments[tournament_id]["events"]) > 0:
                     if rewrite_tournaments:
                         pass
@@ -308,8 +317,9 @@ def download_all_tournaments(
             break
         page += 1
 
+    wait_for_pending_writes()
     if rewrite_tournaments:
-        write_jsonl(list(tournaments.values()), tournament_file_path, with_version=True)
+        write_jsonl(tournaments.values(), tournament_file_path, with_version=True)
 
 # イベントのセットデータを保存する関数
 def download_all_set(event_id, entrant2user, event_dir, lightweight=False):
@@ -317,8 +327,7 @@ def download_all_set(event_id, entrant2user, event_dir, lightweight=False):
     if not all_sets:
         return
 
-    os.makedirs(event_dir, exist_ok=True)
-    write_matches(all_sets, entrant2user, event_dir)
+    submit_write(write_matches, all_sets, entrant2user, event_dir)
 
 def dedupe_set_nodes(all_sets, event_id=None):
     unique_sets = []
@@ -437,7 +446,10 @@ def build_match_dedupe_key(match_data):
 
 def write_matches(all_nodes, entrant2user, event_dir):
     """マッチデータを保存する関数"""
-    json_data = {"data": []}
+    write_json_records(iter_match_data(all_nodes, entrant2user), f"{event_dir}/matches.json", with_version=True)
+
+def iter_match_data(all_nodes, entrant2user):
+    """セットのノードから重複を除いたマッチデータを1件ずつ生成する関数"""
     seen_set_ids = set()
     seen_match_keys = set()
     for node in all_nodes:
@@ -516,9 +528,7 @@ def write_matches(all_nodes, entrant2user, event_dir):
         if match_key in seen_match_keys:
             continue
         seen_match_keys.add(match_key)
-        json_data["data"].append(match_data)
-        
-    write_json(json_data, f"{event_dir}/matches.json", with_version=True)
+        yield match_data
 
 def write_event_attributes(num_entrants, event_id, event_name, tournament_name, timestamp, place, url, labels, is_online, event_dir):
     json_data = {
@@ -534,7 +544,22 @@ def write_event_attributes(num_entrants, event_id, event_name, tournament_name,
         "status": "completed",
         "timestamp": timestamp,
     }
-    write_json(json_data, f"{event_dir}/attr.json", with_version=True)
+    submit_write(write_json, json_data, f"{event_dir}/attr.json", with_version=True)
+
+def sort_by_rank(ranked_pairs):
+    """(順位, user_id) のペアを順位ごとのバケットに振り分けて安定に並べる関数"""
+    if not ranked_pairs:
+        return []
+    min_rank = min(rank for rank, _ in ranked_pairs)
+    max_rank = max(rank for rank, _ in ranked_pairs)
+    span = max_rank - min_rank + 1
+    # 順位が疎な場合はバケットが無駄に大きくなるので通常のソートを使う
+    if span > 4 * len(ranked_pairs):
+        return sorted(ranked_pairs, key=lambda x: x[0])
+    buckets = [[] for _ in range(span)]
+    for pair in ranked_pairs:
+        buckets[pair[0] - min_rank].append(pair)
+    return [pair for bucket in buckets for pair in bucket]
 
 def download_standings(event_id, event_dir):
     """スタンディングデータを保存する関数"""
@@ -568,17 +593,15 @@ def download_standings(event_id, event_dir):
         for node in standings_data
         if node['entrant']['participants'] is not None
     ]
-    placements.sort(key=lambda x: x[0])
     placements_dicts = [
         {"placement": placement, "user_id": user_id}
-        for placement, user_id in placements
+        for placement, user_id in sort_by_rank(placements)
     ]
-    
-    os.makedirs(event_dir, exist_ok=True)
+
     json_data = {
         "data": placements_dicts
     }
-    write_json(json_data, f"{event_dir}/standings.json", with_version=True)
+    submit_write(write_json, json_data, f"{event_dir}/standings.json", with_version=True)
     return user_data, player_data, entrant2user
 
 def download_seeds(event_id, user_data, player_data, entrant2user, event_dir):
@@ -604,15 +627,14 @@ def download_seeds(event_id, user_data, player_data, entrant2user, event_dir):
                     entrant2user[seed['entrant']['id']] = seed['entrant']['participants'][0]['user']['id']
 
     seeds_numbers = [(seed['seedNum'], entrant2user[seed['entrant']['id']] if seed['entrant']['id'] in entrant2user else None) for seed in seeds_data]
-    seeds_numbers.sort(key=lambda x: x[0])
     seeds_dicts = [
         {"seed_num": seed_num, "user_id": user_id}
-        for seed_num, user_id in seeds_numbers
+        for seed_num, user_id in sort_by_rank(seeds_numbers)
     ]
     json_data = {
         "data": seeds_dicts
     }
-    write_json(json_data, f"{event_dir}/seeds.json", with_version=True)
+    submit_write(write_json, json_data, f"{event_dir}/seeds.json", with_version=True)
 
 def extend_user_info(user_data, player_data, users, users_file_path):
     new_users = []
@@ -12,7 +12,8 @@ if ROOT_DIR not in sys.path:
 # get_event_details_by_slug_query を追加する必要がある
 from scripts.queries import (
     get_event_sets_query, get_standings_query, get_seeds_query,
-    get_phase_groups_query, get_event_details_by_tournament_query # この関数を queries.py に追加想定
+    get_phase_groups_query, get_event_details_by_tournament_query, # この関数を queries.py に追加想定
+    get_events_by_slugs_query,
 )
 # utils.py から必要なユーティリティ関数をインポート
 from scripts.utils import (
@@ -46,7 +47,6 @@ def download_all_set(event_id, entrant2user, event_dir):
         print(f"No sets found for event {event_id}.")
         return
 
-    os.makedirs(event_dir, exist_ok=True)
     write_matches(all_sets, entrant2user, event_dir)
     print(f"Successfully wrote matches.json for event {event_id} to {event_dir}")
 
@@ -268,7 +268,6 @@ def write_matches(all_nodes, entrant2user, event_dir):
 
 def write_event_attributes(num_entrants, event_id, event_name, tournament_name, timestamp, place, url, labels, is_online, event_dir):
     """イベントの属性情報をattr.jsonとして保存する"""
-    os.makedirs(event_dir, exist_ok=True) # ディレクトリが存在しない場合は作成
     json_data = {
         "event_id": event_id,
         "tournament_name": tournament_name,
@@ -355,7 +354,6 @@ def download_standings(event_id, event_dir):
         if user_id is not None # user_idがNoneでないものだけ含める
     ]
 
-    os.makedirs(event_dir, exist_ok=True)
     json_data = {"data": placements_dicts}
     write_json(json_data, f"{event_dir}/standings.json", with_version=True)
     print(f"Successfully wrote {len(placements_dicts)} standings to {event_dir}/standings.json. Processed {processed_count}, Skipped {skipped_count} entries.")
@@ -458,7 +456,6 @@ def download_seeds(event_id, user_data, player_data, entrant2user, event_dir):
         if user_id is not None # user_idがNoneでないものだけ含める
     ]
 
-    os.makedirs(event_dir, exist_ok=True)
     json_data = {"data": seeds_dicts}
     write_json(json_data, f"{event_dir}/seeds.json", with_version=True)
     print(f"Successfully wrote {len(seeds_dicts)} seeds to {event_dir}/seeds.json. Processed {processed_count}, Skipped {skipped_count} entries.")
@@ -592,8 +589,11 @@ def fetch_event_details_by_slug(tournament_slug, event_slug):
         print(f"Invalid response structure for event details: {tournament_slug}/{event_slug}. Response: {response_data}")
         return None
     
-    tournament_data = response_data["data"]["tournament"]
-    
+    return merge_event_details(response_data["data"]["tournament"], tournament_slug, event_slug)
+
+
+def merge_event_details(tournament_data, tournament_slug, event_slug):
+    """トーナメントのレスポンスからイベント詳細を取り出し、トーナメント情報と統合する"""
     # events配列を確認
     if not tournament_data.get("events") or not tournament_data["events"]:
         print(f"No matching events found for {tournament_slug}/{event_slug}.")
@@ -630,12 +630,43 @@ def fetch_event_details_by_slug(tournament_slug, event_slug):
     return merged_data # 統合されたデータを返す
 
 
-def download_specific_event(tournament_slug, event_slug, startgg_dir, done_file_path, users_file_path, tournament_file_path, users, tournaments, done_events):
+def fetch_events_details_by_slugs(target_events):
+    """複数イベントの詳細を1回のリクエストでまとめて取得する"""
+    if not target_events:
+        return {}
+    query = get_events_by_slugs_query(len(target_events))
+    variables = {}
+    for i, (tournament_slug, event_slug) in enumerate(target_events):
+        variables[f"tournamentSlug{i}"] = tournament_slug
+        variables[f"eventSlug{i}"] = event_slug
+    try:
+        response_data = fetch_data_with_retries(query, variables)
+    except FetchError as e:
+        print(f"Error fetching event details in batch: {e}")
+        return {}
+
+    if not response_data or not response_data.get("data"):
+        print(f"Invalid response structure for batched event details. Response: {response_data}")
+        return {}
+
+    details = {}
+    for i, (tournament_slug, event_slug) in enumerate(target_events):
+        tournament_data = response_data["data"].get(f"t{i}")
+        if tournament_data is None:
+            print(f"Tournament not found for {tournament_slug}/{event_slug}.")
+            details[(tournament_slug, event_slug)] = None
+            continue
+        details[(tournament_slug, event_slug)] = merge_event_details(tournament_data, tournament_slug, event_slug)
+    return details
+
+
+def download_specific_event(tournament_slug, event_slug, startgg_dir, done_file_path, users_file_path, tournament_file_path, users, tournaments, done_events, event_data=None):
     """指定された単一のイベントデータをダウンロードして保存する"""
     print(f"--- Processing event: {tournament_slug} / {event_slug} ---")
 
-    # 1. イベント詳細を取得
-    event_data = fetch_event_details_by_slug(tournament_slug, event_slug)
+    # 1. イベント詳細を取得 (まとめて取得済みでなければ個別に取得)
+    if event_data is None:
+        event_data = fetch_event_details_by_slug(tournament_slug, event_slug)
     if not event_data:
         print(f"Could not fetch details for event {tournament_slug}/{event_slug}. Skipping.")
         return False # 処理失敗
@@ -783,12 +814,8 @@ def main():
 
     # 既存データの読み込み
     # 存在しない場合は空のデータで初期化
-    if not os.path.exists(os.path.dirname(args.done_file_path)):
-        os.makedirs(os.path.dirname(args.done_file_path), exist_ok=True)
-    if not os.path.exists(os.path.dirname(args.users_file_path)):
-        os.makedirs(os.path.dirname(args.users_file_path), exist_ok=True)
-    if not os.path.exists(os.path.dirname(args.tournament_file_path)):
-        os.makedirs(os.path.dirname(args.tournament_file_path), exist_ok=True)
+    for file_path in (args.done_file_path, args.users_file_path, args.tournament_file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
     done_events = read_set(args.done_file_path, as_int=True)
     users = read_users_jsonl(args.users_file_path)
@@ -803,6 +830,9 @@ def main():
         ("genesis-x2", "ultimate-singles"),
     ]
 
+    # イベント詳細を1回のリクエストでまとめて取得
+    prefetched_events = fetch_events_details_by_slugs(target_events)
+
     # 各イベントを処理
     success_count = 0
     fail_count = 0
@@ -810,7 +840,8 @@ def main():
         success = download_specific_event(
             t_slug, e_slug,
             args.startgg_dir, args.done_file_path, args.users_file_path, args.tournament_file_path,
-            users, tournaments, done_events
+            users, tournaments, done_events,
+            event_data=prefetched_events.get((t_slug, e_slug)),
         )
         if success:
             success_count += 1
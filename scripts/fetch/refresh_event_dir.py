@@ -19,6 +19,7 @@ from scripts.utils import (  # noqa: E402
     set_api_parameters,
     set_indent_num,
     set_retry_parameters,
+    wait_for_pending_writes,
 )
 
 
@@ -64,6 +65,7 @@ def main():
     download_seeds(event_id, user_data, player_data, entrant2user, str(event_dir))
     extend_user_info(user_data, player_data, users, args.users_file_path)
     download_all_set(event_id, entrant2user, str(event_dir))
+    wait_for_pending_writes()
 
     print("Refresh complete.")
 
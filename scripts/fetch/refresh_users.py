@@ -1,22 +1,34 @@
 import argparse
+import atexit
 import os
+import random
 import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
-from scripts.queries import get_user_player_query, get_user_query
+from scripts.queries import get_user_player_query, get_user_query, get_users_batch_query
 from scripts.utils import (
     read_users_jsonl,
     write_jsonl,
+    write_text_atomic,
     extend_jsonl,
+    submit_write,
+    wait_for_pending_writes,
     set_indent_num,
     set_retry_parameters,
     set_api_parameters,
+    set_connection_pool_size,
+    set_rate_limiter,
+    enable_response_cache,
     fetch_data_with_retries,
     FetchError,
+    RateLimiter,
 )
 
 
@@ -37,27 +49,52 @@ def fetch_user_and_player_details(user_id, player_id, sleep_duration):
         query,
         variables,
     )
-    if (
-        "data" not in response
-        or response["data"] is None
-        or "user" not in response["data"]
-        or response["data"]["user"] is None
-    ):
+    data = response.get("data") or {}
+    user = data.get("user")
+    if user is None:
         raise UserNotFoundError(
             f"User {user_id} not found on start.gg (API returned null)."
         )
-    user = response["data"]["user"]
-    player = response["data"].get("player") if player_id is not None else None
+    player = data.get("player") if player_id is not None else None
     return user, player
 
 
+def fetch_users_and_players_batch(records, sleep_duration):
+    """Fetch several users (and their players) with one aliased GraphQL request.
+
+    Returns {user_id: (user_detail, player_detail)}; user_detail is None when
+    start.gg returned null for that user.
+    """
+    if sleep_duration > 0:
+        time.sleep(sleep_duration)
+    with_players = tuple(record.get("player_id") is not None for record in records)
+    variables = {}
+    for i, record in enumerate(records):
+        variables[f"userId{i}"] = record["user_id"]
+        if with_players[i]:
+            variables[f"playerId{i}"] = record["player_id"]
+    response = fetch_data_with_retries(get_users_batch_query(with_players), variables)
+    data = response.get("data")
+    if data is None:
+        raise FetchError(f"Malformed response for user batch: {response}")
+    details = {}
+    for i, record in enumerate(records):
+        player = data.get(f"p{i}") if with_players[i] else None
+        details[record["user_id"]] = (data.get(f"u{i}"), player)
+    return details
+
+
 def refresh_user_record(existing_record, sleep_duration):
+    user_detail, player_detail = fetch_user_and_player_details(
+        existing_record["user_id"], existing_record.get("player_id"), sleep_duration
+    )
+    return build_refreshed_record(existing_record, user_detail, player_detail)
+
+
+def build_refreshed_record(existing_record, user_detail, player_detail):
     user_id = existing_record["user_id"]
     player_id = existing_record.get("player_id")
 
-    user_detail, player_detail = fetch_user_and_player_details(
-        user_id, player_id, sleep_duration
-    )
     gamer_tag = existing_record.get("gamer_tag")
     prefix = existing_record.get("prefix")
     if player_detail is not None:
@@ -67,19 +104,11 @@ def refresh_user_record(existing_record, sleep_duration):
     gender_pronoun = user_detail.get("genderPronoun", "unknown")
     startgg_discriminator = user_detail.get("discriminator")
 
-    x_id = None
-    x_name = None
-    discord_id = None
-    discord_name = None
-    authorizations = user_detail.get("authorizations") or []
-    for auth in authorizations:
-        auth_type = auth.get("type")
-        if auth_type == "TWITTER":
-            x_id = auth.get("externalId")
-            x_name = auth.get("externalUsername")
-        elif auth_type == "DISCORD":
-            discord_id = auth.get("externalId")
-            discord_name = auth.get("externalUsername")
+    accounts = {"TWITTER": (None, None), "DISCORD": (None, None)}
+    for auth in user_detail.get("authorizations") or []:
+        accounts[auth.get("type")] = (auth.get("externalId"), auth.get("externalUsername"))
+    x_id, x_name = accounts["TWITTER"]
+    discord_id, discord_name = accounts["DISCORD"]
 
     refreshed = {
         "user_id": user_id,
@@ -96,6 +125,139 @@ def refresh_user_record(existing_record, sleep_duration):
     return refreshed
 
 
+class RateLimitState:
+    """Exponential backoff shared by every refresh worker.
+
+    A 429 doubles the shared backoff (plus jitter) and pushes back a shared
+    resume_at deadline. Every worker waits for that deadline before sending
+    its next request, so one worker hitting the limit pauses all of them.
+    Successes halve the backoff back toward min_delay.
+    """
+
+    def __init__(self, base_delay, min_delay=0.0, max_delay=60.0):
+        self.base_delay = base_delay
+        self.min_delay = min(min_delay, base_delay)
+        self.max_delay = max(max_delay, base_delay)
+        self.backoff = self.min_delay
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until no pause is in effect."""
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every worker back for at least `seconds` from now."""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def on_rate_limit(self):
+        with self.lock:
+            self.backoff = min(max(self.backoff * 2, self.base_delay), self.max_delay)
+            delay = self.backoff + random.uniform(0, self.backoff / 4)
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+            return delay
+
+    def on_success(self):
+        with self.lock:
+            self.backoff = max(self.backoff / 2, self.min_delay)
+
+
+def refresh_users_with_retries(records, args, limiter=None, rate_state=None):
+    """Refresh a batch of users, backing off on rate limits.
+
+    When a limiter is given, each request waits for a token instead of
+    sleeping for --sleep. A rate-limited batch is split in half before
+    retrying. Returns a list of
+    (record to store, status) in input order, where status is one of
+    "refreshed", "missing" or "failed".
+    """
+    if rate_state is None:
+        rate_state = RateLimitState(max(args.retry_delay, args.sleep * 5, 10), args.sleep)
+    sleep_duration = 0 if limiter is not None else args.sleep
+    for user_attempt in range(1, args.user_retries + 1):
+        try:
+            rate_state.wait()
+            if limiter is not None:
+                limiter.acquire()
+            if len(records) == 1:
+                record = records[0]
+                try:
+                    refreshed = refresh_user_record(record, sleep_duration)
+                except UserNotFoundError as e:
+                    print(f"Info: {e} Keeping existing data.", file=sys.stderr)
+                    rate_state.on_success()
+                    return [(record, "missing")]
+                rate_state.on_success()
+                return [(refreshed, "refreshed")]
+            details = fetch_users_and_players_batch(records, sleep_duration)
+        except FetchError as e:
+            if "Too Many Requests" in str(e):
+                backoff = rate_state.on_rate_limit()
+                user_ids = ", ".join(str(record["user_id"]) for record in records)
+                print(
+                    f"Rate limit hit while refreshing users {user_ids} (attempt {user_attempt}/{args.user_retries}). Pausing all workers for {backoff:.1f}s...",
+                    file=sys.stderr,
+                )
+                if limiter is not None:
+                    limiter.slow_down(backoff * 4)
+                if len(records) > 1:
+                    half = len(records) // 2
+                    return (
+                        refresh_users_with_retries(records[:half], args, limiter, rate_state)
+                        + refresh_users_with_retries(records[half:], args, limiter, rate_state)
+                    )
+                continue
+            print(f"Warning: {e}", file=sys.stderr)
+            break
+        except Exception as e:
+            user_ids = ", ".join(str(record["user_id"]) for record in records)
+            print(
+                f"Failed to refresh users {user_ids}: {e}",
+                file=sys.stderr,
+            )
+            break
+
+        rate_state.on_success()
+        results = []
+        for record in records:
+            user_detail, player_detail = details[record["user_id"]]
+            if user_detail is None:
+                print(
+                    f"Info: User {record['user_id']} not found on start.gg (API returned null). Keeping existing data.",
+                    file=sys.stderr,
+                )
+                results.append((record, "missing"))
+                continue
+            results.append((build_refreshed_record(record, user_detail, player_detail), "refreshed"))
+        return results
+    return [(record, "failed") for record in records]
+
+
+def flush_checkpoint(pending_records, checkpoint_path, background=False):
+    """Append buffered refreshed records to the checkpoint file.
+
+    With background=True the append is queued on the shared writer thread, so
+    the refresh loop does not wait on disk; queued appends keep their order.
+    Otherwise earlier queued appends are waited for and this one is written
+    straight away.
+    """
+    records = pending_records[:]
+    pending_records.clear()
+    if background:
+        if records:
+            submit_write(extend_jsonl, records, checkpoint_path, with_version=True)
+        return
+    wait_for_pending_writes()
+    if records:
+        extend_jsonl(records, checkpoint_path, with_version=True)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Refresh start.gg user information and overwrite users.jsonl"
@@ -140,6 +302,24 @@ def main():
         default=0.25,
         help="Optional sleep duration between API calls to avoid rate limits",
     )
+    parser.add_argument(
+        "--rate_per_minute",
+        type=float,
+        default=0,
+        help="Maximum API requests per minute (token bucket). Replaces --sleep when > 0",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of users fetched per GraphQL request",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of users to refresh in parallel",
+    )
     parser.add_argument(
         "--user_retries",
         type=int,
@@ -169,6 +349,18 @@ def main():
         default=None,
         help="Path to store intermediate refreshed users for resuming later",
     )
+    parser.add_argument(
+        "--checkpoint_flush_every",
+        type=int,
+        default=20,
+        help="Number of refreshed users buffered before appending them to the checkpoint",
+    )
+    parser.add_argument(
+        "--checkpoint_flush_seconds",
+        type=float,
+        default=60.0,
+        help="Also append buffered users to the checkpoint once this many seconds have passed since the last append (0 disables)",
+    )
     parser.add_argument(
         "--force_refresh",
         action="store_true",
@@ -185,6 +377,17 @@ def main():
         default=None,
         help="Path to store and read the refresh cursor index.",
     )
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory for cached start.gg responses (disabled when omitted)",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=3600.0,
+        help="Seconds a cached start.gg response stays valid",
+    )
     args = parser.parse_args()
 
     output_path = args.output_file_path or args.users_file_path
@@ -192,6 +395,7 @@ def main():
     set_indent_num(args.indent_num)
     set_retry_parameters(args.max_retries, args.retry_delay)
     set_api_parameters(args.url, args.token)
+    enable_response_cache(args.cache_dir, args.cache_ttl)
 
     users = read_users_jsonl(args.users_file_path)
     if not users:
@@ -241,35 +445,39 @@ def main():
         checkpoint_dir = os.path.dirname(args.checkpoint_path)
         if checkpoint_dir:
             os.makedirs(checkpoint_dir, exist_ok=True)
-        if os.path.exists(args.checkpoint_path):
+        if args.force_refresh:
+            # The checkpoint is discarded anyway, so don't parse it.
+            if os.path.exists(args.checkpoint_path):
+                print(
+                    "Force refresh enabled. Ignoring existing checkpoint data.",
+                    file=sys.stderr,
+                )
+                os.remove(args.checkpoint_path)
+        else:
             checkpoint_records = read_users_jsonl(args.checkpoint_path)
             if checkpoint_records:
                 print(
                     f"Loaded {len(checkpoint_records)} users from checkpoint {args.checkpoint_path}."
                 )
-        if args.force_refresh and checkpoint_records:
-            print(
-                "Force refresh enabled. Ignoring existing checkpoint data.",
-                file=sys.stderr,
-            )
-            checkpoint_records = {}
-            try:
-                os.remove(args.checkpoint_path)
-            except FileNotFoundError:
-                pass
-
-    # Apply checkpoint data to current users so final output contains latest info
-    for user_id, record in checkpoint_records.items():
-        if user_id in users:
-            users[user_id] = record
-
-    skip_existing = args.checkpoint_path is not None and not args.force_refresh
-    processed_ids = set(checkpoint_records.keys()) if skip_existing else set()
-    initial_processed = sum(1 for user_id in target_user_ids if user_id in processed_ids)
-    if initial_processed and skip_existing:
-        pct = (initial_processed / target_count) * 100 if target_count else 0
+
+    # Apply checkpoint data to current users so final output contains latest info.
+    # Records for users no longer in users.jsonl are harmless: the output only
+    # follows user_order.
+    users.update(checkpoint_records)
+
+    # dict_keys supports O(1) membership, so no separate set is built.
+    # checkpoint_records is empty whenever the checkpoint is not used.
+    processed_ids = checkpoint_records.keys()
+    pending = [
+        (index, user_id)
+        for index, user_id in enumerate(target_user_ids, start=1)
+        if user_id not in processed_ids
+    ]
+    skipped_count = len(target_user_ids) - len(pending)
+    if skipped_count:
+        pct = (skipped_count / target_count) * 100 if target_count else 0
         print(
-            f"Resuming from checkpoint: {initial_processed}/{target_count} target users already processed ({pct:.1f}%)."
+            f"Resuming from checkpoint: {skipped_count}/{target_count} target users already processed ({pct:.1f}%)."
         )
 
     if total_users:
@@ -279,93 +487,90 @@ def main():
 
     failures = set()
     missing_users = set()
-    skipped_count = 0
     newly_processed = 0
-    consecutive_rate_limits = 0
-
-    for index, user_id in enumerate(target_user_ids, start=1):
-        if skip_existing and user_id in processed_ids:
-            skipped_count += 1
-            continue
-
-        record = users[user_id]
-        user_attempt = 0
-        refreshed_record = record
-        success = False
-
-        while user_attempt < args.user_retries:
-            user_attempt += 1
-            try:
-                refreshed_record = refresh_user_record(record, args.sleep)
-                consecutive_rate_limits = 0
-                success = True
-                break
-            except UserNotFoundError as e:
-                print(f"Info: {e} Keeping existing data.", file=sys.stderr)
-                consecutive_rate_limits = 0
-                missing_users.add(user_id)
-                success = True
-                refreshed_record = record
-                break
-            except FetchError as e:
-                if "Too Many Requests" in str(e):
-                    consecutive_rate_limits += 1
-                    backoff = max(
-                        args.retry_delay * consecutive_rate_limits,
-                        args.sleep * 5,
-                        10,
-                    )
-                    print(
-                        f"Rate limit hit while refreshing user {user_id} (attempt {user_attempt}/{args.user_retries}). Sleeping {backoff:.1f}s...",
-                        file=sys.stderr,
-                    )
-                    time.sleep(backoff)
-                    continue
-                print(f"Warning: {e}", file=sys.stderr)
-                consecutive_rate_limits = 0
-                break
-            except Exception as e:
-                print(
-                    f"Failed to refresh user {user_id}: {e}",
-                    file=sys.stderr,
-                )
-                consecutive_rate_limits = 0
-                break
-
-        if not success:
-            failures.add(user_id)
-            continue
-
-        users[user_id] = refreshed_record
-        processed_ids.add(user_id)
-        newly_processed += 1
-
-        if args.checkpoint_path and refreshed_record is not record:
-            extend_jsonl([refreshed_record.copy()], args.checkpoint_path, with_version=True)
-
-        done = index
-
-        if (
-            args.progress_interval
-            and args.progress_interval > 0
-            and done % args.progress_interval == 0
-        ):
-            pct = (done / target_count) * 100 if target_count else 0
-            print(f"[Progress] {done}/{target_count} users processed ({pct:.1f}%).")
-
-        if (
-            args.pause_every
-            and args.pause_every > 0
-            and done % args.pause_every == 0
-        ):
-            print(
-                f"Processed {done} users. Pausing for {args.pause_seconds:.1f}s to avoid rate limits...",
-                file=sys.stderr,
-            )
-            time.sleep(args.pause_seconds)
 
-    final_records = [users[user_id] for user_id in user_order]
-    write_jsonl(final_records, output_path, with_version=True)
+    concurrency = max(1, args.concurrency)
+    set_connection_pool_size(concurrency)
+    batch_size = max(1, args.batch_size)
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    limiter = RateLimiter(args.rate_per_minute) if args.rate_per_minute > 0 else None
+    # Let the limiter also pause until start.gg's X-RateLimit-Reset when the quota runs out.
+    set_rate_limiter(limiter)
+    rate_state = RateLimitState(max(args.retry_delay, args.sleep * 5, 10), args.sleep)
+
+    pending_checkpoint = []
+    last_checkpoint_flush = time.monotonic()
+    if args.checkpoint_path:
+        atexit.register(flush_checkpoint, pending_checkpoint, args.checkpoint_path)
+
+    def refresh_batch(batch):
+        return refresh_users_with_retries(
+            [users[user_id] for _, user_id in batch], args, limiter, rate_state
+        )
+
+    # Keep `concurrency` batches in flight and handle each one as soon as it
+    # finishes, so a slow or rate-limited batch does not hold up the others.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        batch_iter = iter(batches)
+        in_flight = {
+            executor.submit(refresh_batch, batch): batch
+            for batch in islice(batch_iter, concurrency)
+        }
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in sorted(finished, key=lambda f: in_flight[f][0][0]):
+                batch = in_flight.pop(future)
+                for (done, user_id), (refreshed_record, status) in zip(batch, future.result()):
+                    if status == "failed":
+                        failures.add(user_id)
+                        continue
+                    if status == "missing":
+                        missing_users.add(user_id)
+
+                    record = users[user_id]
+                    users[user_id] = refreshed_record
+                    newly_processed += 1
+
+                    if args.checkpoint_path and refreshed_record is not record:
+                        pending_checkpoint.append(refreshed_record.copy())
+                        now = time.monotonic()
+                        if len(pending_checkpoint) >= args.checkpoint_flush_every or (
+                            args.checkpoint_flush_seconds > 0
+                            and now - last_checkpoint_flush >= args.checkpoint_flush_seconds
+                        ):
+                            flush_checkpoint(pending_checkpoint, args.checkpoint_path, background=True)
+                            last_checkpoint_flush = now
+
+                    if (
+                        args.progress_interval
+                        and args.progress_interval > 0
+                        and done % args.progress_interval == 0
+                    ):
+                        pct = (done / target_count) * 100 if target_count else 0
+                        print(f"[Progress] {done}/{target_count} users processed ({pct:.1f}%).")
+
+                    if (
+                        args.pause_every
+                        and args.pause_every > 0
+                        and done % args.pause_every == 0
+                    ):
+                        if args.checkpoint_path:
+                            flush_checkpoint(pending_checkpoint, args.checkpoint_path, background=True)
+                        print(
+                            f"Processed {done} users. Pausing for {args.pause_seconds:.1f}s to avoid rate limits...",
+                            file=sys.stderr,
+                        )
+                        # Hold back every worker, not just this thread, so no
+                        # in-flight batch sends requests during the pause.
+                        rate_state.pause(args.pause_seconds)
+            for batch in islice(batch_iter, len(finished)):
+                in_flight[executor.submit(refresh_batch, batch)] = batch
+
+    if args.checkpoint_path:
+        flush_checkpoint(pending_checkpoint, args.checkpoint_path)
+
+    write_jsonl((users[user_id] for user_id in user_order), output_path, with_version=True)
 
     failure_total = len(failures)
 
@@ -373,8 +578,7 @@ def main():
         cursor_dir = os.path.dirname(args.cursor_path)
         if cursor_dir:
             os.makedirs(cursor_dir, exist_ok=True)
-        with open(args.cursor_path, "w", encoding="utf-8") as cursor_file:
-            cursor_file.write(str(next_index))
+        write_text_atomic(str(next_index), args.cursor_path)
 
     print(
         f"Refreshed {newly_processed} users in this run (target {target_count}/{total_users}). Output written to {output_path}."
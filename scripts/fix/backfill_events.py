@@ -6,8 +6,13 @@ from __future__ import annotations
 import argparse
 import os
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
+from typing import Iterable, Iterator
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 if ROOT_DIR not in sys.path:
@@ -31,8 +36,11 @@ from scripts.utils import (
     read_tournaments_jsonl,
     read_users_jsonl,
     set_api_parameters,
+    set_connection_pool_size,
     set_indent_num,
     set_retry_parameters,
+    tracked_writes,
+    wait_for_pending_writes,
     write_jsonl,
 )
 
@@ -42,15 +50,21 @@ def parse_date(date_str: str) -> int:
     return int(dt.timestamp())
 
 
-def load_event_ids(path: Path) -> list[int]:
-    event_ids = []
+def iter_event_ids(path: Path) -> Iterator[int]:
     with path.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
-            event_ids.append(int(line))
-    return event_ids
+            yield int(line)
+
+
+def iter_tournament_events(tournaments: dict) -> Iterator[dict]:
+    # Snapshot list lengths up front: the backfill loop adds tournaments and
+    # appends events while iterating, and those must not be revisited.
+    snapshot = [(events, len(events)) for events in (t.get("events", []) for t in tournaments.values())]
+    for events, count in snapshot:
+        yield from islice(events, count)
 
 
 def fetch_event_details(event_id: int) -> tuple[dict, dict]:
@@ -91,99 +105,100 @@ def should_process(timestamp: int, since_ts: int | None, until_ts: int | None) -
     return True
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser(
-        description="Backfill existing events by re-downloading data."
-    )
-    parser.add_argument("--url", default="https://api.start.gg/gql/alpha", help="API URL")
-    parser.add_argument("--token", required=True, help="start.gg API token")
-    parser.add_argument("--events_root", default="data/startgg/events", help="Events root directory")
-    parser.add_argument("--users_file_path", default="data/startgg/users.jsonl", help="Path to users.jsonl")
-    parser.add_argument("--tournament_file_path", default="data/startgg/tournaments.jsonl", help="Path to tournaments.jsonl")
-    parser.add_argument("--event_ids_file", default="", help="Optional file with event IDs (one per line)")
-    parser.add_argument("--since", default="", help="Process events from this date (YYYY-MM-DD)")
-    parser.add_argument("--until", default="", help="Process events up to this date (YYYY-MM-DD)")
-    parser.add_argument("--limit", type=int, default=0, help="Limit number of events processed")
-    parser.add_argument("--indent_num", type=int, default=2, help="Indentation level for JSON output")
-    parser.add_argument("--max_retries", type=int, default=10, help="Maximum retries for API requests")
-    parser.add_argument("--retry_delay", type=int, default=5, help="Delay between retries in seconds")
-    args = parser.parse_args()
+@dataclass
+class BackfillState:
+    users: dict
+    tournaments: dict
+    existing_event_ids: dict[int, set]
+    since_ts: int | None
+    until_ts: int | None
+    limit: int
+    processed: int = 0
+    rewrite_tournaments: bool = False
+    place_cache: dict[int, dict] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def reserve_slot(self) -> bool:
+        """Claim one of the --limit slots before downloading an event."""
+        with self.lock:
+            if self.limit and self.processed >= self.limit:
+                return False
+            self.processed += 1
+            return True
+
+    def limit_reached(self) -> bool:
+        with self.lock:
+            return bool(self.limit) and self.processed >= self.limit
+
+    def place_for(self, tournament: dict) -> dict:
+        """Build the place dict once per tournament; events of a tournament share it."""
+        tournament_id = tournament.get("id")
+        if tournament_id is None:
+            return build_place_dict(tournament)
+        place = self.place_cache.get(tournament_id)
+        if place is None:
+            place = self.place_cache[tournament_id] = build_place_dict(tournament)
+        return place
 
-    set_indent_num(args.indent_num)
-    set_retry_parameters(args.max_retries, args.retry_delay)
-    set_api_parameters(args.url, args.token)
 
-    users = read_users_jsonl(args.users_file_path)
-    tournaments = read_tournaments_jsonl(args.tournament_file_path)
-    rewrite_tournaments = False
+def process_event(entry: dict, args: argparse.Namespace, state: BackfillState) -> bool:
+    event_id = entry.get("event_id")
+    if event_id is None:
+        return False
+    try:
+        event_id = int(event_id)
+    except ValueError:
+        return False
 
-    since_ts = parse_date(args.since) if args.since else None
-    until_ts = parse_date(args.until) if args.until else None
+    try:
+        event, tournament = fetch_event_details(event_id)
+    except FetchError as exc:
+        print(exc, file=sys.stderr)
+        return False
 
-    event_entries: list[dict] = []
-    if args.event_ids_file:
-        event_ids = load_event_ids(Path(args.event_ids_file))
-        for event_id in event_ids:
-            event_entries.append({"event_id": event_id})
-    else:
-        for tournament in tournaments.values():
-            for event in tournament.get("events", []):
-                event_entries.append(event)
-
-    processed = 0
-    for entry in event_entries:
-        if args.limit and processed >= args.limit:
-            break
-        event_id = entry.get("event_id")
-        if event_id is None:
-            continue
-        try:
-            event_id = int(event_id)
-        except ValueError:
-            continue
+    event_name = event.get("name") or "Unknown Event"
+    tournament_name = tournament.get("name") or "Unknown Tournament"
+    timestamp = event.get("startAt") or tournament.get("startAt")
+    if timestamp is None:
+        print(f"Event {event_id} has no timestamp. Skipping.", file=sys.stderr)
+        return False
 
-        try:
-            event, tournament = fetch_event_details(event_id)
-        except FetchError as exc:
-            print(exc, file=sys.stderr)
-            continue
-
-        event_name = event.get("name") or "Unknown Event"
-        tournament_name = tournament.get("name") or "Unknown Tournament"
-        timestamp = event.get("startAt") or tournament.get("startAt")
-        if timestamp is None:
-            print(f"Event {event_id} has no timestamp. Skipping.", file=sys.stderr)
-            continue
-
-        if not should_process(timestamp, since_ts, until_ts):
-            continue
-
-        country_code = tournament.get("countryCode") or ""
-        year, month, day = get_date_parts(timestamp)
-        event_dir = entry.get("path")
-        if not event_dir:
-            event_dir = get_event_directory(
-                args.events_root,
-                country_code,
-                year,
-                month,
-                day,
-                tournament_name,
-                event_name,
-            )
-
-        os.makedirs(event_dir, exist_ok=True)
+    if not should_process(timestamp, state.since_ts, state.until_ts):
+        return False
+
+    if not state.reserve_slot():
+        return False
 
+    country_code = tournament.get("countryCode") or ""
+    year, month, day = get_date_parts(timestamp)
+    event_dir = entry.get("path")
+    if not event_dir:
+        event_dir = get_event_directory(
+            args.events_root,
+            country_code,
+            year,
+            month,
+            day,
+            tournament_name,
+            event_name,
+        )
+
+    os.makedirs(event_dir, exist_ok=True)
+
+    # Wait for this event's own background writes before recording it in
+    # tournaments.jsonl, so a failed write never leaves a dangling path behind.
+    with tracked_writes() as writes:
         user_data, player_data, entrant2user = download_standings(event_id, event_dir)
         num_entrants = len(user_data)
         try:
             download_seeds(event_id, user_data, player_data, entrant2user, event_dir)
         except NoPhaseError as exc:
             print(f"Seeds not available for event {event_id}: {exc}", file=sys.stderr)
-        extend_user_info(user_data, player_data, users, args.users_file_path)
+        with state.lock:
+            extend_user_info(user_data, player_data, state.users, args.users_file_path)
         download_all_set(event_id, entrant2user, event_dir)
 
-        place = build_place_dict(tournament)
+        place = state.place_for(tournament)
         labels = {}
         write_event_attributes(
             num_entrants,
@@ -197,27 +212,105 @@ def main() -> int:
             event.get("isOnline"),
             event_dir,
         )
+    write_errors = [future.exception() for future in writes if future.exception() is not None]
+    if write_errors:
+        print(f"Failed to write data for event {event_id}: {write_errors[0]}", file=sys.stderr)
+        return False
 
-        tournament_id = tournament.get("id")
-        if tournament_id is not None:
-            tournament_id = int(tournament_id)
+    tournament_id = tournament.get("id")
+    if tournament_id is not None:
+        tournament_id = int(tournament_id)
+        with state.lock:
+            tournaments = state.tournaments
             if tournament_id not in tournaments:
                 tournaments[tournament_id] = {
                     "tournament_id": tournament_id,
                     "name": tournament_name,
                     "events": [],
                 }
-                rewrite_tournaments = True
-            if not any(e.get("event_id") == event_id for e in tournaments[tournament_id]["events"]):
+                state.rewrite_tournaments = True
+            known_event_ids = state.existing_event_ids.setdefault(tournament_id, set())
+            if event_id not in known_event_ids:
                 tournaments[tournament_id]["events"].append(
                     {"event_id": event_id, "event_name": event_name, "path": event_dir}
                 )
-                rewrite_tournaments = True
-        processed += 1
+                known_event_ids.add(event_id)
+                state.rewrite_tournaments = True
+    return True
+
 
-    if rewrite_tournaments:
-        write_jsonl(list(tournaments.values()), args.tournament_file_path, with_version=True)
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Backfill existing events by re-downloading data."
+    )
+    parser.add_argument("--url", default="https://api.start.gg/gql/alpha", help="API URL")
+    parser.add_argument("--token", required=True, help="start.gg API token")
+    parser.add_argument("--events_root", default="data/startgg/events", help="Events root directory")
+    parser.add_argument("--users_file_path", default="data/startgg/users.jsonl", help="Path to users.jsonl")
+    parser.add_argument("--tournament_file_path", default="data/startgg/tournaments.jsonl", help="Path to tournaments.jsonl")
+    parser.add_argument("--event_ids_file", default="", help="Optional file with event IDs (one per line)")
+    parser.add_argument("--since", default="", help="Process events from this date (YYYY-MM-DD)")
+    parser.add_argument("--until", default="", help="Process events up to this date (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, default=0, help="Limit number of events processed")
+    parser.add_argument("--indent_num", type=int, default=2, help="Indentation level for JSON output")
+    parser.add_argument("--max_retries", type=int, default=10, help="Maximum retries for API requests")
+    parser.add_argument("--retry_delay", type=int, default=5, help="Delay between retries in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="Number of events to backfill in parallel")
+    args = parser.parse_args()
+
+    set_indent_num(args.indent_num)
+    set_retry_parameters(args.max_retries, args.retry_delay)
+    set_api_parameters(args.url, args.token)
+
+    users = read_users_jsonl(args.users_file_path)
+    tournaments = read_tournaments_jsonl(args.tournament_file_path)
+
+    since_ts = parse_date(args.since) if args.since else None
+    until_ts = parse_date(args.until) if args.until else None
+
+    event_entries: Iterable[dict]
+    if args.event_ids_file:
+        event_entries = (
+            {"event_id": event_id} for event_id in iter_event_ids(Path(args.event_ids_file))
+        )
+    else:
+        event_entries = iter_tournament_events(tournaments)
+
+    state = BackfillState(
+        users=users,
+        tournaments=tournaments,
+        existing_event_ids={
+            tournament_id: {e.get("event_id") for e in tournament.get("events", [])}
+            for tournament_id, tournament in tournaments.items()
+        },
+        since_ts=since_ts,
+        until_ts=until_ts,
+        limit=args.limit,
+    )
 
+    workers = max(1, args.workers)
+    set_connection_pool_size(workers)
+    # Keep `workers` events in flight and top up as each one finishes, so an
+    # event with many pages does not hold up the others.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {
+            executor.submit(process_event, entry, args, state)
+            for entry in islice(event_entries, workers)
+        }
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+            for entry in islice(event_entries, len(finished)):
+                if state.limit_reached():
+                    break
+                in_flight.add(executor.submit(process_event, entry, args, state))
+
+    wait_for_pending_writes()
+    if state.rewrite_tournaments:
+        write_jsonl(tournaments.values(), args.tournament_file_path, with_version=True)
+
+    processed = state.processed
     print(f"Backfill complete. Processed {processed} events.")
     return 0
 
@@ -5,30 +5,49 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
+import random
+import stat
 import sys
-from dataclasses import dataclass
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from scripts.fix.io_helpers import iter_jsonl_lines, loads, walk_attr
 
 DEFAULT_TOURNAMENTS = Path("data/startgg/tournaments.jsonl")
 DEFAULT_EVENTS_ROOT = Path("data/startgg/events")
 DEFAULT_API_URL = "https://api.start.gg/gql/alpha"
+DEFAULT_CACHE_FILE = Path(".cache/event_tournament.json")
+DEFAULT_ATTR_CACHE_FILE = Path(".cache/attr_cache.json")
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
 JSON_VERSION = "1.0"
 
-EVENT_TOURNAMENT_QUERY = """
-query EventTournament($eventId: ID!) {
-  event(id: $eventId) {
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept": "application/json"})
+
+EVENT_TOURNAMENT_FIELDS = """
     id
     name
     tournament {
       id
       name
     }
-  }
-}
-""".strip()
+""".strip("\n")
 
 
 @dataclass
@@ -40,6 +59,21 @@ class MissingEvent:
     reason: str
 
 
+@dataclass
+class AttrCache:
+    entries: Dict[str, dict]
+    dirty: bool = False
+    touched: set = field(default_factory=set)
+
+    def prune(self) -> None:
+        """Drop entries for attr.json files that were not read during this walk."""
+        stale = self.entries.keys() - self.touched
+        if stale:
+            for key in stale:
+                del self.entries[key]
+            self.dirty = True
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description=(
@@ -90,76 +124,136 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Report planned additions without writing tournaments.jsonl.",
     )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Always rewrite the whole tournaments.jsonl instead of appending new tournaments.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Number of events looked up per GraphQL request (default: {DEFAULT_BATCH_SIZE}).",
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=Path,
+        default=DEFAULT_CACHE_FILE,
+        help=f"JSON file caching event_id -> tournament lookups between runs (default: {DEFAULT_CACHE_FILE}).",
+    )
+    parser.add_argument(
+        "--attr-cache-file",
+        type=Path,
+        default=DEFAULT_ATTR_CACHE_FILE,
+        help=f"JSON file caching parsed attr.json keyed by mtime and size (default: {DEFAULT_ATTR_CACHE_FILE}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore and do not update the lookup and attr caches.",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f"Retries for rate-limited (429) or 5xx lookups, with exponential backoff (default: {DEFAULT_MAX_RETRIES}).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of lookup requests sent in parallel (default: {DEFAULT_WORKERS}).",
+    )
     return parser.parse_args()
 
 
 def load_tournaments(path: Path) -> List[dict]:
-    entries: List[dict] = []
-    with path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line:
-                continue
-            entries.append(json.loads(line))
-    return entries
+    return [loads(line) for _, line in iter_jsonl_lines(path)]
 
 
 def build_event_index(tournaments: List[dict]) -> Dict[str, dict]:
-    index: Dict[str, dict] = {}
-    for entry in tournaments:
-        events = entry.get("events", [])
-        if not isinstance(events, list):
-            continue
-        for event in events:
-            path = event.get("path")
-            if isinstance(path, str):
-                index[path] = event
-    return index
+    return {
+        event["path"]: event
+        for entry in tournaments
+        for events in (entry.get("events"),)
+        if type(events) is list
+        for event in events
+        if type(event.get("path")) is str
+    }
 
 
 def iter_event_dirs(events_root: Path) -> List[Path]:
-    return [path.parent for path in events_root.glob("**/attr.json")]
+    return [Path(path) for path in walk_attr(str(events_root))]
+
+
+def repo_relative_converter(repo_root: Path) -> Callable[[str], str]:
+    """Return a function that strips the ``repo_root`` prefix from path strings."""
+    prefix = repo_root.as_posix().rstrip("/") + "/"
+    prefix_len = len(prefix)
+
+    def convert(path: str) -> str:
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+        return path[prefix_len:] if path.startswith(prefix) else path
+
+    return convert
 
 
 def to_repo_relative(path: Path, repo_root: Path) -> str:
-    try:
-        rel = path.relative_to(repo_root)
-    except ValueError:
-        rel = path
-    return rel.as_posix()
+    return repo_relative_converter(repo_root)(os.fspath(path))
 
 
-def read_attr(event_dir: Path) -> dict | None:
-    attr_file = event_dir / "attr.json"
-    if not attr_file.is_file():
+def read_attr(event_dir: Path, cache: Optional[AttrCache] = None) -> dict | None:
+    """Parse attr.json, reusing ``cache`` entries whose mtime and size still match."""
+    attr_file = os.path.join(event_dir, "attr.json")
+    try:
+        st = os.stat(attr_file)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
         return None
+    if cache is not None:
+        cache.touched.add(attr_file)
+        cached = cache.entries.get(attr_file)
+        if (
+            type(cached) is dict
+            and "attr" in cached
+            and cached.get("mtime_ns") == st.st_mtime_ns
+            and cached.get("size") == st.st_size
+        ):
+            return cached["attr"]
     try:
-        with attr_file.open("r", encoding="utf-8") as handle:
-            return json.load(handle)
+        with open(attr_file, "rb") as handle:
+            attr = loads(handle.read())
     except json.JSONDecodeError:
         return None
+    if cache is not None:
+        cache.entries[attr_file] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "attr": attr}
+        cache.dirty = True
+    return attr
 
 
-def fetch_tournament_id(event_id: int, api_url: str, token: str) -> tuple[Optional[int], Optional[str]]:
-    payload = json.dumps({"query": EVENT_TOURNAMENT_QUERY, "variables": {"eventId": event_id}}).encode("utf-8")
-    request = Request(api_url, data=payload)
-    request.add_header("Content-Type", "application/json")
-    request.add_header("Accept", "application/json")
-    request.add_header("Authorization", f"Bearer {token}")
+def load_attr_cache(path: Path) -> AttrCache:
+    if not path.is_file():
+        return AttrCache(entries={})
     try:
-        with urlopen(request, timeout=30) as response:
-            data = json.loads(response.read().decode("utf-8"))
-    except HTTPError as exc:
-        raise RuntimeError(f"HTTP error {exc.code} while fetching event {event_id}: {exc.reason}") from exc
-    except URLError as exc:
-        raise RuntimeError(f"Network error while fetching event {event_id}: {exc.reason}") from exc
+        raw = loads(path.read_bytes())
+    except (OSError, json.JSONDecodeError):
+        return AttrCache(entries={})
+    return AttrCache(entries=raw if isinstance(raw, dict) else {})
+
+
+@lru_cache(maxsize=None)
+def build_event_tournament_query(count: int) -> str:
+    """Build one query that looks up ``count`` events through aliases e0, e1, ..."""
+    params = ", ".join(f"$eventId{i}: ID!" for i in range(count))
+    selections = "\n".join(
+        f"  e{i}: event(id: $eventId{i}) {{\n{EVENT_TOURNAMENT_FIELDS}\n  }}" for i in range(count)
+    )
+    return f"query EventTournaments({params}) {{\n{selections}\n}}"
 
-    errors = data.get("errors")
-    if errors:
-        message = errors[0].get("message", "unknown error")
-        raise RuntimeError(f"GraphQL error for event {event_id}: {message}")
 
-    event_data = data.get("data", {}).get("event")
+def parse_event_tournament(event_data: Optional[dict]) -> tuple[Optional[int], Optional[str]]:
     if not event_data:
         return None, None
     tournament = event_data.get("tournament")
@@ -173,13 +267,146 @@ def fetch_tournament_id(event_id: int, api_url: str, token: str) -> tuple[Option
         return None, name
 
 
+@lru_cache(maxsize=None)
+def _payload_prefix(count: int) -> bytes:
+    """Pre-encoded '{"query": ..., "variables": {' for a batch of ``count`` events."""
+    query = json.dumps(build_event_tournament_query(count))
+    return f'{{"query": {query}, "variables": {{'.encode("utf-8")
+
+
+def encode_event_payload(event_ids: List[int]) -> bytes:
+    variables = ", ".join(f'"eventId{i}": {int(event_id)}' for i, event_id in enumerate(event_ids))
+    return _payload_prefix(len(event_ids)) + variables.encode("ascii") + b"}}"
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    delay = RETRY_BASE_DELAY * 2 ** attempt + random.random()
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(delay, RETRY_MAX_DELAY)
+
+
+def _post_with_retries(api_url: str, payload: bytes, token: str, label: str, max_retries: int) -> dict:
+    """POST a GraphQL payload, retrying 429/5xx responses and dropped connections."""
+    for attempt in range(max_retries + 1):
+        can_retry = attempt < max_retries
+        try:
+            response = _SESSION.post(
+                api_url,
+                data=payload,
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                timeout=30,
+            )
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            if not can_retry:
+                raise RuntimeError(f"Network error while fetching {label}: {exc}") from exc
+            delay = _retry_delay(attempt, None)
+            print(f"[RETRY] {label}: {exc} ({delay:.1f}s 後に再試行 {attempt + 1}/{max_retries})", file=sys.stderr)
+            time.sleep(delay)
+            continue
+        except requests.RequestException as exc:
+            raise RuntimeError(f"Network error while fetching {label}: {exc}") from exc
+
+        if can_retry and response.status_code in RETRY_STATUS_CODES:
+            delay = _retry_delay(attempt, response.headers.get("Retry-After"))
+            print(
+                f"[RETRY] {label}: HTTP {response.status_code} ({delay:.1f}s 後に再試行 {attempt + 1}/{max_retries})",
+                file=sys.stderr,
+            )
+            time.sleep(delay)
+            continue
+        try:
+            response.raise_for_status()
+            return loads(response.content)
+        except requests.HTTPError as exc:
+            raise RuntimeError(f"HTTP error {response.status_code} while fetching {label}: {response.reason}") from exc
+        except ValueError as exc:
+            raise RuntimeError(f"Invalid JSON while fetching {label}: {exc}") from exc
+    raise RuntimeError(f"Retries exhausted while fetching {label}")
+
+
+def fetch_tournament_ids(
+    event_ids: List[int], api_url: str, token: str, max_retries: int = DEFAULT_MAX_RETRIES
+) -> Dict[int, tuple[Optional[int], Optional[str]]]:
+    """Look up the tournaments of several events with a single aliased request."""
+    if not event_ids:
+        return {}
+    payload = encode_event_payload(event_ids)
+    label = ", ".join(str(event_id) for event_id in event_ids)
+    data = _post_with_retries(api_url, payload, token, f"events {label}", max_retries)
+
+    errors = data.get("errors")
+    if errors:
+        message = errors[0].get("message", "unknown error")
+        raise RuntimeError(f"GraphQL error for events {label}: {message}")
+
+    results = data.get("data") or {}
+    return {
+        event_id: parse_event_tournament(results.get(f"e{i}"))
+        for i, event_id in enumerate(event_ids)
+    }
+
+
+def load_lookup_cache(path: Path) -> Dict[int, tuple[Optional[int], Optional[str]]]:
+    if not path.is_file():
+        return {}
+    try:
+        raw = loads(path.read_bytes())
+    except (OSError, json.JSONDecodeError):
+        return {}
+    cache: Dict[int, tuple[Optional[int], Optional[str]]] = {}
+    for key, value in raw.items():
+        try:
+            cache[int(key)] = (value["tournament_id"], value.get("tournament_name"))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+    return cache
+
+
+def save_lookup_cache(cache: Dict[int, tuple[Optional[int], Optional[str]]], path: Path) -> None:
+    serialisable = {
+        str(event_id): {"tournament_id": tournament_id, "tournament_name": tournament_name}
+        for event_id, (tournament_id, tournament_name) in sorted(cache.items())
+    }
+    _write_json_atomic(serialisable, path)
+
+
+def _write_json_atomic(payload: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as handle:
+        json.dump(payload, handle, ensure_ascii=False)
+    tmp_path.replace(path)
+
+
+def _dump_tournaments(entries: List[dict], handle, indent: Optional[int]) -> None:
+    lines = [
+        json.dumps({**entry, "version": JSON_VERSION}, ensure_ascii=False, indent=indent) + "\n"
+        for entry in entries
+    ]
+    handle.write("".join(lines))
+
+
 def write_tournaments(entries: List[dict], path: Path, indent: Optional[int]) -> None:
     with path.open("w", encoding="utf-8") as handle:
-        for entry in entries:
-            serialisable = dict(entry)
-            serialisable["version"] = JSON_VERSION
-            json.dump(serialisable, handle, ensure_ascii=False, indent=indent)
+        _dump_tournaments(entries, handle, indent)
+
+
+def append_tournaments(entries: List[dict], path: Path, indent: Optional[int]) -> None:
+    """Append new entries to the end of tournaments.jsonl without rewriting it."""
+    with path.open("rb") as handle:
+        handle.seek(0, os.SEEK_END)
+        needs_newline = handle.tell() > 0
+        if needs_newline:
+            handle.seek(-1, os.SEEK_END)
+            needs_newline = handle.read(1) != b"\n"
+    with path.open("a", encoding="utf-8") as handle:
+        if needs_newline:
             handle.write("\n")
+        _dump_tournaments(entries, handle, indent)
 
 
 def main() -> int:
@@ -200,12 +427,15 @@ def main() -> int:
     event_index = build_event_index(tournaments)
 
     missing_events: List[MissingEvent] = []
+    attr_cache = None if args.no_cache else load_attr_cache(args.attr_cache_file)
 
-    for event_dir in iter_event_dirs(events_root):
-        attr = read_attr(event_dir)
-        rel_path = to_repo_relative(event_dir, repo_root)
+    relative = repo_relative_converter(repo_root)
+    for event_dir_str in walk_attr(str(events_root)):
+        rel_path = relative(event_dir_str)
         if rel_path in event_index:
             continue
+        event_dir = Path(event_dir_str)
+        attr = read_attr(event_dir, attr_cache)
 
         if attr is None:
             missing_events.append(
@@ -233,13 +463,19 @@ def main() -> int:
             )
         )
 
+    if attr_cache is not None:
+        # Directories registered in the index are never read again, so their entries are dead weight.
+        attr_cache.prune()
+    if attr_cache is not None and attr_cache.dirty:
+        _write_json_atomic(attr_cache.entries, args.attr_cache_file)
+
     if not missing_events:
         print("欠落しているイベントは見つかりませんでした。")
         return 0
 
     print("登録されていないイベントが見つかりました:")
     for item in missing_events:
-        rel = to_repo_relative(item.path, repo_root)
+        rel = relative(str(item.path))
         print(
             f"- {rel} | event_id={item.event_id} | event_name={item.event_name} | "
             f"tournament_name={item.tournament_name} | reason={item.reason}"
@@ -257,22 +493,57 @@ def main() -> int:
         entry.get("tournament_id"): entry for entry in tournaments if isinstance(entry.get("tournament_id"), int)
     }
 
+    cache = {} if args.no_cache else load_lookup_cache(args.cache_file)
+    lookups: Dict[int, tuple[Optional[int], Optional[str]]] = {}
+    lookup_ids = []
+    for item in missing_events:
+        if item.event_id is None or item.event_id in lookups:
+            continue
+        if item.event_id in cache:
+            lookups[item.event_id] = cache[item.event_id]
+        else:
+            lookup_ids.append(item.event_id)
+    lookup_ids = list(dict.fromkeys(lookup_ids))
+    batch_size = max(1, args.batch_size)
+    lookup_errors: Dict[int, RuntimeError] = {}
+    batches = [lookup_ids[start:start + batch_size] for start in range(0, len(lookup_ids), batch_size)]
+
+    def lookup(batch: List[int]):
+        try:
+            return batch, fetch_tournament_ids(batch, args.api_url, args.token, args.max_retries)
+        except RuntimeError as exc:
+            return batch, exc
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        for batch, result in executor.map(lookup, batches):
+            if isinstance(result, RuntimeError):
+                lookup_errors.update(dict.fromkeys(batch, result))
+            else:
+                lookups.update(result)
+                # Misses are not cached: the event may be linked to a tournament later.
+                cache.update((event_id, found) for event_id, found in result.items() if found[0] is not None)
+
+    if lookup_ids and not args.no_cache:
+        save_lookup_cache(cache, args.cache_file)
+
     updated = False
+    new_tournaments: List[dict] = []
+    new_tournament_ids = set()
+    rewrite_needed = False
     for item in missing_events:
         if item.event_id is None:
             print(f"[SKIP] {item.path}: event_id が取得できないため追加できません。", file=sys.stderr)
             continue
-        try:
-            tournament_id, tournament_name = fetch_tournament_id(item.event_id, args.api_url, args.token)
-        except RuntimeError as exc:
-            print(f"[ERROR] {item.path}: {exc}", file=sys.stderr)
+        if item.event_id in lookup_errors:
+            print(f"[ERROR] {item.path}: {lookup_errors[item.event_id]}", file=sys.stderr)
             continue
+        tournament_id, tournament_name = lookups[item.event_id]
 
         if tournament_id is None:
             print(f"[SKIP] {item.path}: トーナメントIDを取得できませんでした。", file=sys.stderr)
             continue
 
-        rel_path = to_repo_relative(item.path, repo_root)
+        rel_path = relative(str(item.path))
         tournament_entry = tournaments_by_id.get(tournament_id)
         event_payload = {
             "event_id": item.event_id,
@@ -286,6 +557,8 @@ def main() -> int:
                 print(f"[SKIP] {rel_path}: 既に登録済みです。")
                 continue
             events.append(event_payload)
+            if tournament_id not in new_tournament_ids:
+                rewrite_needed = True
             print(f"[ADD] 既存トーナメント {tournament_id} にイベント {item.event_id} を追加しました。")
         else:
             name = tournament_name or item.tournament_name or f"Tournament {tournament_id}"
@@ -296,6 +569,8 @@ def main() -> int:
             }
             tournaments.append(new_entry)
             tournaments_by_id[tournament_id] = new_entry
+            new_tournaments.append(new_entry)
+            new_tournament_ids.add(tournament_id)
             print(f"[ADD] 新規トーナメント {tournament_id} ({name}) を追加しました。")
         updated = True
 
@@ -307,7 +582,10 @@ def main() -> int:
         print("Dry-run モードのため tournaments.jsonl は書き換えていません。")
         return 0
 
-    write_tournaments(tournaments, tournaments_file, args.indent)
+    if rewrite_needed or args.compact:
+        write_tournaments(tournaments, tournaments_file, args.indent)
+    else:
+        append_tournaments(new_tournaments, tournaments_file, args.indent)
     print(f"{tournaments_file} を更新しました。")
     return 0
 
@@ -5,8 +5,18 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
+import sys
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Iterator
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from scripts.fix.io_helpers import loads
 
 DEFAULT_TOURNAMENTS = Path("data/startgg/tournaments.jsonl")
 DEFAULT_REQUIRED_FILES = ("attr.json", "matches.json", "standings.json", "seeds.json")
@@ -59,6 +69,7 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+@lru_cache(maxsize=4096)
 def normalise_path(raw_path: str, repo_root: Path) -> Path:
     path = Path(raw_path)
     if not path.is_absolute():
@@ -66,16 +77,28 @@ def normalise_path(raw_path: str, repo_root: Path) -> Path:
     return path
 
 
+@lru_cache(maxsize=4096)
+def list_files(directory: Path) -> frozenset[str] | None:
+    """Names of the regular files in ``directory``, or None if it is not a directory."""
+    try:
+        with os.scandir(directory) as entries:
+            return frozenset(entry.name for entry in entries if entry.is_file())
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
 def check_event(event: dict, repo_root: Path, required_files: tuple[str, ...]) -> EventCheckResult:
     raw_path = event.get("path")
     if not raw_path:
         return EventCheckResult(event=event, ok=False, reason="event path missing")
 
     event_dir = normalise_path(raw_path, repo_root)
-    if not event_dir.is_dir():
+    # One scandir per event instead of an is_dir() plus an is_file() stat per required file.
+    present = list_files(event_dir)
+    if present is None:
         return EventCheckResult(event=event, ok=False, reason=f"missing directory: {event_dir}")
 
-    missing = [name for name in required_files if not (event_dir / name).is_file()]
+    missing = [name for name in required_files if name not in present]
     if missing:
         return EventCheckResult(
             event=event,
@@ -100,70 +123,81 @@ def build_required_files(args: argparse.Namespace) -> tuple[str, ...]:
     return tuple(ordered)
 
 
+def clean_entry(
+    entry: dict,
+    repo_root: Path,
+    required_files: tuple[str, ...],
+    verbose: bool,
+    report_lines: list[str],
+) -> dict | None:
+    """Return ``entry`` without its broken events, or None when it should be dropped."""
+    events = entry.get("events", [])
+    if not isinstance(events, list):
+        report_lines.append(
+            f"Skipped tournament {entry.get('tournament_id')} (events is not a list)."
+        )
+        return None
+
+    kept_events: list[dict] = []
+    removed_events: list[EventCheckResult] = []
+
+    for event in events:
+        result = check_event(event, repo_root, required_files)
+        if result.ok:
+            kept_events.append(event)
+            if verbose:
+                report_lines.append(
+                    f"[OK] tournament_id={entry.get('tournament_id')} "
+                    f"event_id={event.get('event_id')} path={event.get('path')}"
+                )
+        else:
+            removed_events.append(result)
+            report_lines.append(
+                f"[REMOVE] tournament_id={entry.get('tournament_id')} "
+                f"event_id={event.get('event_id')} reason={result.reason}"
+            )
+
+    if kept_events:
+        new_entry = {k: v for k, v in entry.items() if k != "events"}
+        new_entry["events"] = kept_events
+        return new_entry
+    if removed_events:
+        report_lines.append(
+            f"[DROP] tournament_id={entry.get('tournament_id')} removed entirely "
+            "because no valid events remain."
+        )
+    return None
+
+
 def clean_tournaments(
     tournaments: list[dict], repo_root: Path, required_files: tuple[str, ...], verbose: bool
 ) -> tuple[list[dict], list[str]]:
     cleaned: list[dict] = []
     report_lines: list[str] = []
-
     for entry in tournaments:
-        events = entry.get("events", [])
-        if not isinstance(events, list):
-            report_lines.append(
-                f"Skipped tournament {entry.get('tournament_id')} (events is not a list)."
-            )
-            continue
-
-        kept_events: list[dict] = []
-        removed_events: list[EventCheckResult] = []
-
-        for event in events:
-            result = check_event(event, repo_root, required_files)
-            if result.ok:
-                kept_events.append(event)
-                if verbose:
-                    report_lines.append(
-                        f"[OK] tournament_id={entry.get('tournament_id')} "
-                        f"event_id={event.get('event_id')} path={event.get('path')}"
-                    )
-            else:
-                removed_events.append(result)
-                report_lines.append(
-                    f"[REMOVE] tournament_id={entry.get('tournament_id')} "
-                    f"event_id={event.get('event_id')} reason={result.reason}"
-                )
-
-        if kept_events:
-            new_entry = {k: v for k, v in entry.items() if k != "events"}
-            new_entry["events"] = kept_events
+        new_entry = clean_entry(entry, repo_root, required_files, verbose, report_lines)
+        if new_entry is not None:
             cleaned.append(new_entry)
-        elif removed_events:
-            report_lines.append(
-                f"[DROP] tournament_id={entry.get('tournament_id')} removed entirely "
-                "because no valid events remain."
-            )
-
     return cleaned, report_lines
 
 
-def read_jsonl(path: Path) -> list[dict]:
-    records: list[dict] = []
-    with path.open("r", encoding="utf-8") as handle:
+def iter_jsonl(path: Path) -> Iterator[dict]:
+    with path.open("rb") as handle:
         for line in handle:
-            line = line.strip()
-            if not line:
+            if not line.strip():
                 continue
-            records.append(json.loads(line))
-    return records
+            yield loads(line)
 
 
-def write_jsonl(records: list[dict], path: Path) -> None:
-    with path.open("w", encoding="utf-8") as handle:
-        for record in records:
-            record = dict(record)
-            record["version"] = JSON_VERSION
-            json.dump(record, handle, ensure_ascii=False)
-            handle.write("\n")
+def dump_record(record: dict) -> str:
+    """Serialise one tournament line, stamping the version in place.
+
+    Records come fresh from iter_jsonl and are not reused after being written,
+    so there is no need to copy them first.
+    """
+    if record.get("version") != JSON_VERSION:
+        record["version"] = JSON_VERSION
+    return json.dumps(record, ensure_ascii=False) + "\n"
 
 
 def main() -> None:
@@ -175,24 +209,48 @@ def main() -> None:
     repo_root = args.repo_root.resolve()
     required_files = build_required_files(args)
 
-    tournaments = read_jsonl(tournaments_file)
-    cleaned, report_lines = clean_tournaments(tournaments, repo_root, required_files, args.verbose)
-
-    if report_lines:
-        print("\n".join(report_lines))
-    else:
+    # Stream the file: each cleaned record goes straight to a temporary file that
+    # replaces tournaments.jsonl at the end, so memory stays flat for large files.
+    tmp_path = tournaments_file.with_name(tournaments_file.name + ".tmp")
+    output = None if args.dry_run else tmp_path.open("w", encoding="utf-8")
+    changed = False
+    kept_count = 0
+    reported = False
+    try:
+        for entry in iter_jsonl(tournaments_file):
+            report_lines: list[str] = []
+            new_entry = clean_entry(entry, repo_root, required_files, args.verbose, report_lines)
+            if report_lines:
+                print("\n".join(report_lines))
+                reported = True
+            if new_entry != entry:
+                changed = True
+            if new_entry is None:
+                continue
+            kept_count += 1
+            if output is not None:
+                output.write(dump_record(new_entry))
+    except BaseException:
+        if output is not None:
+            output.close()
+            tmp_path.unlink(missing_ok=True)
+        raise
+
+    if not reported:
         print("No missing tournaments detected.")
 
     if args.dry_run:
         print("Dry run mode enabled; tournaments.jsonl not modified.")
         return
 
-    if cleaned == tournaments:
+    output.close()
+    if not changed:
+        tmp_path.unlink()
         print("No changes written; tournaments.jsonl already consistent.")
         return
 
-    write_jsonl(cleaned, tournaments_file)
-    print(f"Updated {tournaments_file} with {len(cleaned)} valid tournaments remaining.")
+    os.replace(tmp_path, tournaments_file)
+    print(f"Updated {tournaments_file} with {kept_count} valid tournaments remaining.")
 
 
 if __name__ == "__main__":
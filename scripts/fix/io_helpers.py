@@ -0,0 +1,61 @@
+"""JSON and directory-walking helpers shared by the scripts in scripts/fix."""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library.
+    orjson = None
+
+_json_decode = json.JSONDecoder().decode
+
+
+def _stdlib_loads(data: bytes | str):
+    if not isinstance(data, str):
+        data = data.decode("utf-8-sig")
+    return _json_decode(data)
+
+
+loads = orjson.loads if orjson is not None else _stdlib_loads
+
+
+def walk_attr(root: str) -> Iterator[str]:
+    """Yield every directory under ``root`` that contains an attr.json file."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name == "attr.json" and entry.is_file():
+                        yield current
+        except OSError:
+            continue
+
+
+def iter_jsonl_lines(path: Path, chunk_size: int = 1 << 20) -> Iterator[tuple[int, bytes]]:
+    """Yield (line number, raw bytes) for each non-blank line, reading in large chunks."""
+    line_no = 0
+    tail = b""
+    with path.open("rb") as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk:
+                break
+            lines = chunk.split(b"\n")
+            if tail:
+                lines[0] = tail + lines[0]
+            tail = lines.pop()
+            for line in lines:
+                line_no += 1
+                if line.strip():
+                    yield line_no, line
+    if tail.strip():
+        yield line_no + 1, tail
@@ -5,9 +5,18 @@ from __future__ import annotations
 
 import argparse
 import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Union
 
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from scripts.fix.io_helpers import iter_jsonl_lines, loads, walk_attr
 
 REQUIRED_EVENT_FILES = ("attr.json", "matches.json", "seeds.json", "standings.json")
 
@@ -37,85 +46,115 @@ PLACE_REQUIRED_FIELDS = (
 )
 
 LIST_CONTAINER_FIELDS = ("data",)
+# Frozensets of the field tuples for a C-level set difference; the tuples keep the report order.
+_REQUIRED_FIELD_SETS = {
+    fields: frozenset(fields) for fields in (ATTR_REQUIRED_FIELDS, PLACE_REQUIRED_FIELDS, LIST_CONTAINER_FIELDS)
+}
 MAX_MISSING_USER_RATIO_ERROR = 0.2
 MAX_MISSING_MATCH_ID_RATIO_ERROR = 0.1
 MAX_MISMATCHED_MATCH_ID_RATIO_ERROR = 0.05
 MIN_MATCH_COUNT_FOR_MISMATCH_ERROR = 5
+DEFAULT_IO_THREADS = 32
+
+
+def load_json(path: Path | str) -> Dict:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
 
+# Error-message prefix. A callable is only formatted when an error is actually reported.
+Context = Union[str, Callable[[], str]]
 
-def load_json(path: Path) -> Dict:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
 
+def _describe(context: Context) -> str:
+    return context() if callable(context) else context
 
-def validate_required_fields(obj: Dict, fields: tuple, context: str, errors: List[str]) -> None:
-    for field in fields:
-        if field not in obj:
-            errors.append(f"{context}: missing field '{field}'")
 
+def validate_required_fields(obj: Dict, fields: tuple, context: Context, errors: List[str]) -> None:
+    required = _REQUIRED_FIELD_SETS.get(fields)
+    if required is None:
+        required = frozenset(fields)
+    missing = required - obj.keys()
+    if missing:
+        prefix = _describe(context)
+        errors.extend(f"{prefix}: missing field '{field}'" for field in fields if field in missing)
 
-def validate_attr(data: Dict, context: str, errors: List[str]) -> None:
+
+def validate_attr(data: Dict, context: Context, errors: List[str]) -> None:
     validate_required_fields(data, ATTR_REQUIRED_FIELDS, context, errors)
     place = data.get("place")
     if isinstance(place, dict):
-        validate_required_fields(place, PLACE_REQUIRED_FIELDS, f"{context}.place", errors)
+        validate_required_fields(place, PLACE_REQUIRED_FIELDS, lambda: f"{_describe(context)}.place", errors)
     elif place is None:
-        errors.append(f"{context}: place is missing")
+        errors.append(f"{_describe(context)}: place is missing")
     else:
-        errors.append(f"{context}: place is not an object")
+        errors.append(f"{_describe(context)}: place is not an object")
 
 
-def validate_list_container(data: Dict, context: str, errors: List[str]) -> None:
-    validate_required_fields(data, LIST_CONTAINER_FIELDS, context, errors)
-    if "data" in data and not isinstance(data["data"], list):
-        errors.append(f"{context}: data is not a list")
+def validate_list_container(data: Dict, context: Context, errors: List[str]) -> None:
+    if "data" not in data:
+        errors.append(f"{_describe(context)}: missing field 'data'")
+    elif type(data["data"]) is not list:
+        errors.append(f"{_describe(context)}: data is not a list")
 
 
 def validate_event_dir(event_dir: Path) -> tuple[List[str], List[str]]:
     errors: List[str] = []
     warnings: List[str] = []
-    payloads: Dict[str, Dict] = {}
-
+    attr = None
+    # Only the fields the checks below need are kept from each list container, so the
+    # parsed matches/standings/seeds documents can be freed right after loading.
+    # None means "data" was not a list.
+    standing_user_ids: Optional[List] = []
+    seed_count: Optional[int] = 0
+    match_pairs: Optional[List[tuple]] = []
+
+    event_dir_str = str(event_dir)
     for filename in REQUIRED_EVENT_FILES:
-        path = event_dir / filename
-        if not path.exists():
+        try:
+            payload = load_json(os.path.join(event_dir_str, filename))
+        except FileNotFoundError:
             errors.append(f"{event_dir}: missing file {filename}")
             continue
-        try:
-            payload = load_json(path)
         except json.JSONDecodeError as exc:
             errors.append(f"{event_dir}: invalid JSON in {filename} ({exc})")
             continue
 
-        payloads[filename] = payload
-        context = f"{event_dir}/{filename}"
+        context = lambda filename=filename: f"{event_dir}/{filename}"  # noqa: E731
         if filename == "attr.json":
             validate_attr(payload, context, errors)
-        else:
-            validate_list_container(payload, context, errors)
+            attr = payload
+            continue
+
+        validate_list_container(payload, context, errors)
+        items = payload.get("data", [])
+        is_list = isinstance(items, list)
+        if filename == "standings.json":
+            standing_user_ids = [item.get("user_id") for item in items] if is_list else None
+        elif filename == "seeds.json":
+            seed_count = len(items) if is_list else None
+        elif filename == "matches.json":
+            match_pairs = [(item.get("winner_id"), item.get("loser_id")) for item in items] if is_list else None
+        del payload, items
 
-    attr = payloads.get("attr.json")
     num_entrants = None
     if isinstance(attr, dict):
         num_entrants = attr.get("num_entrants")
 
-    standings = payloads.get("standings.json", {}).get("data", [])
-    seeds = payloads.get("seeds.json", {}).get("data", [])
-    matches = payloads.get("matches.json", {}).get("data", [])
-
     # When num_entrants is unknown, treat empty standings/seeds as an error as well.
     # This keeps validation strict for partially populated attr.json.
     should_have_entries = not (isinstance(num_entrants, int) and num_entrants == 0)
     if should_have_entries:
-        if isinstance(standings, list) and len(standings) == 0:
+        if standing_user_ids is not None and len(standing_user_ids) == 0:
             errors.append(f"{event_dir}: standings.json is empty but num_entrants > 0")
-        if isinstance(seeds, list) and len(seeds) == 0:
+        if seed_count == 0:
             errors.append(f"{event_dir}: seeds.json is empty but num_entrants > 0")
 
-    if isinstance(standings, list):
-        missing_users = sum(1 for item in standings if item.get("user_id") is None)
-        if standings:
-            ratio = missing_users / len(standings)
+    if standing_user_ids is not None:
+        # list.count runs in C; JSON values never compare equal to None unless they are null.
+        missing_users = standing_user_ids.count(None)
+        if standing_user_ids:
+            ratio = missing_users / len(standing_user_ids)
         else:
             ratio = 0
         if missing_users:
@@ -128,12 +167,22 @@ def validate_event_dir(event_dir: Path) -> tuple[List[str], List[str]]:
                     f"{event_dir}: standings missing user_id for {missing_users} entries"
                 )
 
-    if isinstance(matches, list):
-        missing_winners = sum(1 for item in matches if item.get("winner_id") is None)
-        missing_losers = sum(1 for item in matches if item.get("loser_id") is None)
+    if match_pairs is not None:
+        standing_ids = frozenset(standing_user_ids or ()) - {None}
+        in_standings = standing_ids.__contains__
+        missing_winners = missing_losers = missing_in_standings = 0
+        for winner_id, loser_id in match_pairs:
+            if winner_id is None:
+                missing_winners += 1
+            elif not in_standings(winner_id):
+                missing_in_standings += 1
+            if loser_id is None:
+                missing_losers += 1
+            elif not in_standings(loser_id):
+                missing_in_standings += 1
         missing_total = missing_winners + missing_losers
-        if missing_total and matches:
-            ratio = missing_total / (len(matches) * 2)
+        if missing_total and match_pairs:
+            ratio = missing_total / (len(match_pairs) * 2)
             if ratio > MAX_MISSING_MATCH_ID_RATIO_ERROR:
                 errors.append(
                     f"{event_dir}: matches missing winner/loser ratio {ratio:.1%} exceeds threshold"
@@ -143,68 +192,65 @@ def validate_event_dir(event_dir: Path) -> tuple[List[str], List[str]]:
                     f"{event_dir}: matches missing winner/loser IDs "
                     f"(winner={missing_winners}, loser={missing_losers})"
                 )
-        if isinstance(standings, list) and standings and len(matches) == 0:
+        if standing_user_ids and len(match_pairs) == 0:
             warnings.append(f"{event_dir}: matches.json is empty but standings exist")
 
-        if isinstance(standings, list):
-            standing_ids = {item.get("user_id") for item in standings if item.get("user_id") is not None}
-            if standing_ids:
-                missing_in_standings = 0
-                for item in matches:
-                    winner_id = item.get("winner_id")
-                    loser_id = item.get("loser_id")
-                    if winner_id is not None and winner_id not in standing_ids:
-                        missing_in_standings += 1
-                    if loser_id is not None and loser_id not in standing_ids:
-                        missing_in_standings += 1
-                if missing_in_standings:
-                    ratio = missing_in_standings / (len(matches) * 2)
-                    if (
-                        len(matches) >= MIN_MATCH_COUNT_FOR_MISMATCH_ERROR
-                        and ratio > MAX_MISMATCHED_MATCH_ID_RATIO_ERROR
-                    ):
-                        errors.append(
-                            f"{event_dir}: match IDs not in standings ratio {ratio:.1%} exceeds threshold"
-                        )
-                    else:
-                        warnings.append(
-                            f"{event_dir}: match IDs not in standings ({missing_in_standings} entries)"
-                        )
+        # Without any standing user IDs there is nothing to compare the matches against.
+        if standing_ids and missing_in_standings:
+            ratio = missing_in_standings / (len(match_pairs) * 2)
+            if (
+                len(match_pairs) >= MIN_MATCH_COUNT_FOR_MISMATCH_ERROR
+                and ratio > MAX_MISMATCHED_MATCH_ID_RATIO_ERROR
+            ):
+                errors.append(
+                    f"{event_dir}: match IDs not in standings ratio {ratio:.1%} exceeds threshold"
+                )
+            else:
+                warnings.append(
+                    f"{event_dir}: match IDs not in standings ({missing_in_standings} entries)"
+                )
 
     return errors, warnings
 
 
 def iter_event_dirs(events_root: Path):
-    for path in events_root.rglob("attr.json"):
-        yield path.parent
+    for path in walk_attr(str(events_root)):
+        yield Path(path)
+
 
+def validate_tournaments_file(
+    tournaments_file: Path,
+    errors: List[str],
+    known_dirs: Optional[frozenset] = None,
+) -> None:
+    """Check that every event path listed in tournaments.jsonl exists.
 
-def validate_tournaments_file(tournaments_file: Path, errors: List[str]) -> None:
+    known_dirs holds absolute, normalised event directories already found by
+    iter_event_dirs; paths in it are accepted without touching the filesystem,
+    and only the remaining ones fall back to a stat.
+    """
     if not tournaments_file.exists():
         errors.append(f"{tournaments_file}: file not found")
         return
-    with tournaments_file.open("r", encoding="utf-8") as f:
-        for line_no, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                record = json.loads(line)
-            except json.JSONDecodeError as exc:
-                errors.append(f"{tournaments_file}:{line_no}: invalid JSON ({exc})")
+    for line_no, line in iter_jsonl_lines(tournaments_file):
+        try:
+            record = loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+            errors.append(f"{tournaments_file}:{line_no}: invalid JSON ({exc})")
+            continue
+        events = record.get("events") or []
+        if not isinstance(events, list):
+            errors.append(f"{tournaments_file}:{line_no}: events is not a list")
+            continue
+        for event in events:
+            path = event.get("path")
+            if not path:
+                errors.append(f"{tournaments_file}:{line_no}: event missing path")
                 continue
-            events = record.get("events") or []
-            if not isinstance(events, list):
-                errors.append(f"{tournaments_file}:{line_no}: events is not a list")
+            if known_dirs is not None and os.path.abspath(path) in known_dirs:
                 continue
-            for event in events:
-                path = event.get("path")
-                if not path:
-                    errors.append(f"{tournaments_file}:{line_no}: event missing path")
-                    continue
-                event_dir = Path(path)
-                if not event_dir.exists():
-                    errors.append(f"{tournaments_file}:{line_no}: missing event dir {path}")
+            if not os.path.exists(path):
+                errors.append(f"{tournaments_file}:{line_no}: missing event dir {path}")
 
 
 def main() -> int:
@@ -226,21 +272,55 @@ def main() -> int:
         action="store_true",
         help="Treat warnings as errors.",
     )
+    parser.add_argument(
+        "--workers",
+        "--jobs",
+        dest="workers",
+        type=int,
+        default=0,
+        help="Workers for validating event dirs (0: default for --pool, 1: no pool).",
+    )
+    parser.add_argument(
+        "--pool",
+        choices=("process", "thread"),
+        default="process",
+        help=(
+            "Use worker processes (parsing-bound) or threads (I/O-bound, e.g. cold cache or network disks). "
+            f"Default workers: CPU count for process, {DEFAULT_IO_THREADS} for thread."
+        ),
+    )
     args = parser.parse_args()
 
     events_root = Path(args.events_root)
     errors: List[str] = []
     warnings: List[str] = []
+    known_dirs: Optional[frozenset] = None
 
     if not events_root.exists():
         errors.append(f"{events_root}: events root not found")
     else:
-        for event_dir in iter_event_dirs(events_root):
-            event_errors, event_warnings = validate_event_dir(event_dir)
-            errors.extend(event_errors)
-            warnings.extend(event_warnings)
+        event_dirs = list(iter_event_dirs(events_root))
+        known_dirs = frozenset(os.path.abspath(event_dir) for event_dir in event_dirs)
+        if args.pool == "thread":
+            executor_class = ThreadPoolExecutor
+            default_workers = DEFAULT_IO_THREADS
+        else:
+            executor_class = ProcessPoolExecutor
+            default_workers = os.cpu_count() or 1
+        workers = args.workers if args.workers > 0 else default_workers
+        # Workers build and return their own (errors, warnings) lists; only this loop
+        # merges them, as each result arrives.
+        with ExitStack() as stack:
+            if workers == 1 or len(event_dirs) <= 1:
+                results = map(validate_event_dir, event_dirs)
+            else:
+                executor = stack.enter_context(executor_class(max_workers=workers))
+                results = executor.map(validate_event_dir, event_dirs, chunksize=64)
+            for event_errors, event_warnings in results:
+                errors.extend(event_errors)
+                warnings.extend(event_warnings)
 
-    validate_tournaments_file(Path(args.tournaments_file), errors)
+    validate_tournaments_file(Path(args.tournaments_file), errors, known_dirs)
 
     if errors:
         for error in errors:
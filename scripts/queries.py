@@ -1,7 +1,7 @@
-from datetime import datetime
+import time
+from functools import lru_cache
 
-def get_event_sets_query():
-    return """query EventSets($eventId: ID!, $page: Int!, $perPage: Int!) {
+EVENT_SETS_QUERY = """query EventSets($eventId: ID!, $page: Int!, $perPage: Int!) {
       event(id: $eventId) {
         id
         name
@@ -31,16 +31,10 @@ def get_event_sets_query():
               id
               entrant {
                 id
-                participants {
-                  user {
-                    id
-                  }
-                }
               }
               standing {
                 stats {
                   score {
-                    label
                     value
                   }
                 }
@@ -60,11 +54,6 @@ def get_event_sets_query():
                 id
                 entrant {
                   id
-                  participants {
-                    user {
-                      id
-                    }
-                  }
                 }
                 character {
                   id
@@ -77,8 +66,10 @@ def get_event_sets_query():
       }
     }"""
 
-def get_event_sets_light_query():
-    return """query EventSetsLight($eventId: ID!, $page: Int!, $perPage: Int!) {
+def get_event_sets_query():
+    return EVENT_SETS_QUERY
+
+EVENT_SETS_LIGHT_QUERY = """query EventSetsLight($eventId: ID!, $page: Int!, $perPage: Int!) {
       event(id: $eventId) {
         id
         name
@@ -112,7 +103,6 @@ def get_event_sets_light_query():
               standing {
                 stats {
                   score {
-                    label
                     value
                   }
                 }
@@ -134,8 +124,10 @@ def get_event_sets_light_query():
       }
     }"""
 
-def get_standings_query():
-    return """query EventStandings($eventId: ID!, $page: Int!, $perPage: Int!) {
+def get_event_sets_light_query():
+    return EVENT_SETS_LIGHT_QUERY
+
+STANDINGS_QUERY = """query EventStandings($eventId: ID!, $page: Int!, $perPage: Int!) {
       event(id: $eventId) {
         standings(query: {page: $page, perPage: $perPage}) {
           pageInfo {
@@ -169,8 +161,10 @@ def get_standings_query():
       }
     }"""
 
-def get_seeds_query():
-    return """query PhaseSeeds($phaseId: ID!, $page: Int!, $perPage: Int!) {
+def get_standings_query():
+    return STANDINGS_QUERY
+
+SEEDS_QUERY = """query PhaseSeeds($phaseId: ID!, $page: Int!, $perPage: Int!) {
       phase(id: $phaseId) {
         id
         seeds(query: {
@@ -209,23 +203,11 @@ def get_seeds_query():
       }
     }"""
 
-def get_user_query():
-    return """query UserDetails($userId: ID!) {
-      user(id: $userId) {
-        id
-        genderPronoun
-        discriminator
-        authorizations(types: [TWITTER, DISCORD]) {
-          externalId
-          externalUsername
-          type
-        }
-      }
-    }"""
+def get_seeds_query():
+    return SEEDS_QUERY
 
-def get_user_player_query():
-    return """query UserAndPlayer($userId: ID!, $playerId: ID!) {
-      user(id: $userId) {
+# user / player の選択セットは単体クエリとバッチクエリで共有する
+USER_SELECTION = """{
         id
         genderPronoun
         discriminator
@@ -234,16 +216,51 @@ def get_user_player_query():
           externalUsername
           type
         }
-      }
-      player(id: $playerId) {
+      }"""
+
+PLAYER_SELECTION = """{
         id
         gamerTag
         prefix
-      }
-    }"""
+      }"""
 
-def get_tournament_events_query():
-    return """query TournamentEvents($tournamentId: ID!, $gameId: ID!) {
+USER_QUERY = f"""query UserDetails($userId: ID!) {{
+      user(id: $userId) {USER_SELECTION}
+    }}"""
+
+def get_user_query():
+    return USER_QUERY
+
+USER_PLAYER_QUERY = f"""query UserAndPlayer($userId: ID!, $playerId: ID!) {{
+      user(id: $userId) {USER_SELECTION}
+      player(id: $playerId) {PLAYER_SELECTION}
+    }}"""
+
+def get_user_player_query():
+    return USER_PLAYER_QUERY
+
+@lru_cache(maxsize=256)
+def get_users_batch_query(with_players):
+    """複数ユーザー (と対応するプレイヤー) をエイリアスで1回のクエリにまとめるGraphQLクエリ
+
+    with_players[i] が真のとき、i 番目のユーザーについて player も取得する。
+    同じ組み合わせのクエリ文字列を使い回すため、with_players はタプルで渡す。
+    """
+    variable_defs = []
+    selections = []
+    for i, with_player in enumerate(with_players):
+        variable_defs.append(f"$userId{i}: ID!")
+        selections.append(f"      u{i}: user(id: $userId{i}) {USER_SELECTION}")
+        if with_player:
+            variable_defs.append(f"$playerId{i}: ID!")
+            selections.append(f"      p{i}: player(id: $playerId{i}) {PLAYER_SELECTION}")
+    variable_text = ", ".join(variable_defs)
+    selection_text = "\n".join(selections)
+    return f"""query UsersBatch({variable_text}) {{
+{selection_text}
+    }}"""
+
+TOURNAMENT_EVENTS_QUERY = """query TournamentEvents($tournamentId: ID!, $gameId: ID!) {
       tournament(id: $tournamentId) {
         id
         name
@@ -256,8 +273,7 @@ def get_tournament_events_query():
       }
     }""" 
 
-def get_event_entrants_query():
-    return """query EventEntrants($eventId: ID!, $page: Int!, $perPage: Int!) {
+EVENT_ENTRANTS_QUERY = """query EventEntrants($eventId: ID!, $page: Int!, $perPage: Int!) {
       event(id: $eventId) {
         entrants(query: {page: $page, perPage: $perPage}) {
           pageInfo {
@@ -275,8 +291,13 @@ def get_event_entrants_query():
       }
     }"""
 
-def get_phase_groups_query():
-    return """query PhaseGroupsByEvent($eventId: ID!, $page: Int!, $perPage: Int!) {
+def get_event_entrants_query():
+    return EVENT_ENTRANTS_QUERY
+
+def get_tournament_events_query():
+    return TOURNAMENT_EVENTS_QUERY
+
+PHASE_GROUPS_QUERY = """query PhaseGroupsByEvent($eventId: ID!, $page: Int!, $perPage: Int!) {
       event(id: $eventId) {
         phases {
           id
@@ -293,9 +314,15 @@ def get_phase_groups_query():
       }
     }"""
 
-def get_tournaments_by_game_query(country_code="", before_now=True, past=False):
+def get_phase_groups_query():
+    return PHASE_GROUPS_QUERY
+
+@lru_cache(maxsize=64)
+def _tournaments_by_game_parts(country_code, past):
+    """beforeDate 以外の部分を組み立てて (前半, 後半) で返す (beforeDate は呼び出し毎に変わる)"""
     first_row = """query TournamentsByGame($gameId: ID!, $perPage: Int!, $page: Int!) {"""
-    second_row = """tournaments(query: {perPage: $perPage, page: $page, sortBy: "startAt desc", filter: {videogameIds: [$gameId], published: true, *other_filters*}}) {"""
+    second_row_head = """tournaments(query: {perPage: $perPage, page: $page, sortBy: "startAt desc", filter: {videogameIds: [$gameId], published: true, """
+    second_row_tail = """}}) {"""
     nodes_query = """nodes {
             id
             name
@@ -326,24 +353,25 @@ def get_tournaments_by_game_query(country_code="", before_now=True, past=False):
       filters += f' ,countryCode: "{country_code}" '
     if past:
       filters += """ ,past: true """
-    if before_now:
-      filters += f" ,beforeDate: {int(datetime.now().timestamp())} "
     
-    second_row = second_row.replace("*other_filters*", filters)
+    return f"{first_row}\n{second_row_head}{filters}", f"{second_row_tail}\n{nodes_query}"
 
-    query = "\n".join([first_row, second_row, nodes_query])
-    return query
+def get_tournaments_by_game_query(country_code="", before_now=True, past=False):
+    head, tail = _tournaments_by_game_parts(country_code, past)
+    if before_now:
+      return f"{head} ,beforeDate: {int(time.time())} {tail}"
+    return head + tail
 
-def get_tournament_url_query():
-    return """query Tournament($tournamentId: ID!) {
+TOURNAMENT_URL_QUERY = """query Tournament($tournamentId: ID!) {
       tournament(id: $tournamentId) {
         url
       }
     }"""
 
-def get_event_details_by_tournament_query():
-    """トーナメントスラッグからイベント詳細を取得するGraphQLクエリ"""
-    return """
+def get_tournament_url_query():
+    return TOURNAMENT_URL_QUERY
+
+EVENT_DETAILS_BY_TOURNAMENT_QUERY = """
     query TournamentEventsQuery($tournamentSlug: String!, $eventSlug: String!) {
       tournament(slug: $tournamentSlug) {
         id
@@ -372,8 +400,51 @@ def get_event_details_by_tournament_query():
     }
     """
 
-def get_event_details_by_id_query():
-    return """query EventById($eventId: ID!) {
+def get_event_details_by_tournament_query():
+    """トーナメントスラッグからイベント詳細を取得するGraphQLクエリ"""
+    return EVENT_DETAILS_BY_TOURNAMENT_QUERY
+
+@lru_cache(maxsize=64)
+def get_events_by_slugs_query(num_events):
+    """複数の (トーナメントスラッグ, イベントスラッグ) をエイリアスで1回のクエリにまとめるGraphQLクエリ
+
+    件数ごとにクエリ文字列を使い回す。
+    """
+    variable_defs = ", ".join(
+        f"$tournamentSlug{i}: String!, $eventSlug{i}: String!" for i in range(num_events)
+    )
+    selections = "\n".join(
+        f"""      t{i}: tournament(slug: $tournamentSlug{i}) {{
+        id
+        name
+        slug
+        countryCode
+        city
+        lat
+        lng
+        venueName
+        timezone
+        postalCode
+        venueAddress
+        mapsPlaceId
+        url
+        events(filter: {{slug: $eventSlug{i}}}) {{
+          id
+          name
+          slug
+          startAt
+          isOnline
+          numEntrants
+          state
+        }}
+      }}"""
+        for i in range(num_events)
+    )
+    return f"""query EventsBySlugs({variable_defs}) {{
+{selections}
+    }}"""
+
+EVENT_DETAILS_BY_ID_QUERY = """query EventById($eventId: ID!) {
       event(id: $eventId) {
         id
         name
@@ -401,3 +472,6 @@ def get_event_details_by_id_query():
         }
       }
     }"""
+
+def get_event_details_by_id_query():
+    return EVENT_DETAILS_BY_ID_QUERY
@@ -68,9 +68,10 @@ def write_json_file(data, output_path: Path, indent: int, overwrite: bool):
     if output_path.exists() and not overwrite:
         raise FileExistsError(f"{output_path} already exists. Use --overwrite to replace it.")
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with output_path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=indent)
-        f.write("\n")
+    # Encode once and write the whole buffer, instead of json.dump's many small writes.
+    buffer = (json.dumps(data, ensure_ascii=False, indent=indent) + "\n").encode("utf-8")
+    with output_path.open("wb") as f:
+        f.write(buffer)
 
 
 def main():
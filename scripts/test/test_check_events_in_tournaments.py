@@ -0,0 +1,92 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from scripts.fix.check_events_in_tournaments import (
+    AttrCache,
+    append_tournaments,
+    fetch_tournament_ids,
+    load_lookup_cache,
+    load_tournaments,
+    read_attr,
+    save_lookup_cache,
+)
+
+
+class FetchTournamentIdsTests(unittest.TestCase):
+    @patch("scripts.fix.check_events_in_tournaments._SESSION.post")
+    def test_looks_up_events_in_one_request(self, mock_post):
+        mock_post.return_value.content = json.dumps(
+            {
+                "data": {
+                    "e0": {"id": 10, "name": "Singles", "tournament": {"id": "100", "name": "Cup"}},
+                    "e1": None,
+                }
+            }
+        ).encode("utf-8")
+
+        results = fetch_tournament_ids([10, 11], "https://example.invalid/gql", "token")
+
+        self.assertEqual(results, {10: (100, "Cup"), 11: (None, None)})
+        self.assertEqual(mock_post.call_count, 1)
+        payload = json.loads(mock_post.call_args.kwargs["data"])
+        self.assertEqual(payload["variables"], {"eventId0": 10, "eventId1": 11})
+        self.assertIn("e1: event(id: $eventId1)", payload["query"])
+
+    @patch("scripts.fix.check_events_in_tournaments.time.sleep")
+    @patch("scripts.fix.check_events_in_tournaments._SESSION.post")
+    def test_retries_rate_limited_requests(self, mock_post, mock_sleep):
+        limited = MagicMock(status_code=429, headers={"Retry-After": "7"})
+        ok = MagicMock(status_code=200, content=b'{"data": {"e0": {"tournament": {"id": 5, "name": "Cup"}}}}')
+        mock_post.side_effect = [limited, ok]
+
+        results = fetch_tournament_ids([10], "https://example.invalid/gql", "token")
+
+        self.assertEqual(results, {10: (5, "Cup")})
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertGreaterEqual(mock_sleep.call_args.args[0], 7)
+
+
+class LookupCacheTests(unittest.TestCase):
+    def test_cache_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "cache" / "event_tournament.json"
+            self.assertEqual(load_lookup_cache(path), {})
+            save_lookup_cache({10: (100, "大会"), 11: (101, None)}, path)
+            self.assertEqual(load_lookup_cache(path), {10: (100, "大会"), 11: (101, None)})
+
+
+class AttrCacheTests(unittest.TestCase):
+    def test_ignores_malformed_entries_and_prunes_unread_ones(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            event_dir = Path(tmpdir)
+            (event_dir / "attr.json").write_text('{"event_id": 1}', encoding="utf-8")
+            attr_file = str(event_dir / "attr.json")
+            cache = AttrCache(entries={attr_file: ["not", "a", "dict"], "gone/attr.json": {"attr": {}}})
+
+            self.assertEqual(read_attr(event_dir, cache), {"event_id": 1})
+            cache.prune()
+
+        self.assertEqual(list(cache.entries), [attr_file])
+        self.assertTrue(cache.dirty)
+
+
+class AppendTournamentsTests(unittest.TestCase):
+    def test_appends_after_last_line_without_rewriting(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "tournaments.jsonl"
+            path.write_text('{"tournament_id": 1, "version": "1.0"}', encoding="utf-8")
+            append_tournaments([{"tournament_id": 2, "name": "大会", "events": []}], path, None)
+            self.assertEqual(
+                load_tournaments(path),
+                [
+                    {"tournament_id": 1, "version": "1.0"},
+                    {"tournament_id": 2, "name": "大会", "events": [], "version": "1.0"},
+                ],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -14,6 +14,7 @@ from scripts.fetch.download import (
     fetch_all_sets,
     get_event_directory,
     should_skip_tournament,
+    sort_by_rank,
     write_matches,
 )
 from scripts.utils import FetchError
@@ -82,6 +83,11 @@ class DownloadTests(unittest.TestCase):
         self.assertEqual(mock_fetch_all_nodes.call_args_list[0].kwargs["per_page"], 50)
         self.assertEqual(mock_fetch_all_nodes.call_args_list[1].kwargs["per_page"], 25)
 
+    def test_sort_by_rank_keeps_ties_in_input_order(self):
+        pairs = [(5, 10), (1, 20), (5, 30), (3, 40), (2, None)]
+        self.assertEqual(sort_by_rank(pairs), sorted(pairs, key=lambda x: x[0]))
+        self.assertEqual(sort_by_rank([(1000, 1), (1, 2)]), [(1, 2), (1000, 1)])
+
     def test_build_match_dedupe_key_ignores_details(self):
         base = {
             "winner_id": 1,
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from scripts.fetch.refresh_users import RateLimitState
+
+
+class RateLimitStateTests(unittest.TestCase):
+    @patch("scripts.fetch.refresh_users.random.uniform", return_value=0.0)
+    @patch("scripts.fetch.refresh_users.time.sleep")
+    @patch("scripts.fetch.refresh_users.time.monotonic")
+    def test_rate_limit_pauses_every_worker(self, mock_monotonic, mock_sleep, _mock_uniform):
+        clock = [100.0]
+        mock_monotonic.side_effect = lambda: clock[0]
+
+        def advance(seconds):
+            clock[0] += seconds
+
+        mock_sleep.side_effect = advance
+        state = RateLimitState(10, min_delay=1)
+
+        self.assertEqual(state.on_rate_limit(), 10)
+        # Another worker that did not see the 429 still waits out the pause.
+        state.wait()
+
+        self.assertEqual(clock[0], 110.0)
+        mock_sleep.assert_called_once_with(10.0)
+
+    @patch("scripts.fetch.refresh_users.time.sleep")
+    @patch("scripts.fetch.refresh_users.time.monotonic")
+    def test_pause_holds_back_workers(self, mock_monotonic, mock_sleep):
+        clock = [50.0]
+        mock_monotonic.side_effect = lambda: clock[0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        state = RateLimitState(10)
+
+        state.pause(5)
+        state.wait()
+
+        self.assertEqual(clock[0], 55.0)
+
+    @patch("scripts.fetch.refresh_users.random.uniform", return_value=0.0)
+    def test_success_decays_backoff_toward_min_delay(self, _mock_uniform):
+        state = RateLimitState(10, min_delay=1)
+        state.on_rate_limit()
+        state.on_rate_limit()
+        self.assertEqual(state.backoff, 20)
+
+        state.on_success()
+        self.assertEqual(state.backoff, 10)
+        # A single success does not wipe the state: the next 429 keeps escalating.
+        self.assertEqual(state.on_rate_limit(), 20)
+
+        for _ in range(10):
+            state.on_success()
+        self.assertEqual(state.backoff, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,20 @@
+import json
+import os
+import tempfile
 import unittest
 from unittest.mock import patch
 
-from scripts.utils import fetch_all_nodes, set_request_timeout
+from scripts.utils import (
+    RateLimiter,
+    fetch_all_nodes,
+    read_users_jsonl,
+    set_indent_num,
+    set_page_delay,
+    set_page_prefetch,
+    set_request_timeout,
+    write_json,
+    write_json_records,
+)
 
 
 class FetchAllNodesTests(unittest.TestCase):
@@ -60,20 +73,237 @@ class FetchAllNodesTests(unittest.TestCase):
         self.assertEqual(nodes, [{"id": 1}])
         self.assertEqual(mock_fetch.call_count, 2)
 
+    @patch("scripts.utils.fetch_data_with_retries")
+    def test_fetch_all_nodes_prefetches_remaining_pages_in_order(self, mock_fetch):
+        def side_effect(_query, variables):
+            page = variables["page"]
+            return {
+                "data": {
+                    "event": {
+                        "sets": {
+                            "pageInfo": {"totalPages": 4},
+                            "nodes": [{"id": page * 10}, {"id": page * 10 + 1}],
+                        }
+                    }
+                }
+            }
+
+        mock_fetch.side_effect = side_effect
+        set_page_delay(0)
+        set_page_prefetch(3)
+        try:
+            nodes = fetch_all_nodes("query", {"eventId": 1}, ["event", "sets"], per_page=2)
+        finally:
+            set_page_prefetch(1)
+            set_page_delay(2)
+
+        self.assertEqual([node["id"] for node in nodes], [10, 11, 20, 21, 30, 31, 40, 41])
+        self.assertEqual(
+            sorted(call.args[1]["page"] for call in mock_fetch.call_args_list), [1, 2, 3, 4]
+        )
+
 
 class FetchDataWithRetriesTests(unittest.TestCase):
-    @patch("scripts.utils.requests.post")
+    @patch("scripts.utils.requests.Session.post")
     def test_fetch_data_with_retries_passes_timeout(self, mock_post):
         from scripts.utils import fetch_data_with_retries
 
         set_request_timeout(12)
-        mock_post.return_value.text = '{"data": {"ok": true}}'
+        mock_post.return_value.content = b'{"data": {"ok": true}}'
         mock_post.return_value.raise_for_status.return_value = None
 
         payload = fetch_data_with_retries("query", {"eventId": 1})
 
         self.assertEqual(payload, {"data": {"ok": True}})
         self.assertEqual(mock_post.call_args.kwargs["timeout"], 12)
+        self.assertEqual(
+            json.loads(mock_post.call_args.kwargs["data"]),
+            {"query": "query", "variables": {"eventId": 1}},
+        )
+
+    @patch("scripts.utils.time.sleep")
+    @patch("scripts.utils.requests.Session.post")
+    def test_fetch_data_with_retries_honours_retry_after(self, mock_post, mock_sleep):
+        import requests
+
+        from scripts.utils import fetch_data_with_retries, set_retry_parameters
+
+        limited = requests.Response()
+        limited.status_code = 429
+        limited.headers["Retry-After"] = "30"
+        ok = requests.Response()
+        ok.status_code = 200
+        ok._content = b'{"data": {"ok": true}}'
+        mock_post.side_effect = [limited, ok]
+        set_retry_parameters(3, 1)
+        try:
+            payload = fetch_data_with_retries("query", {"eventId": 1})
+        finally:
+            set_retry_parameters(100, 5)
+
+        self.assertEqual(payload, {"data": {"ok": True}})
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertGreaterEqual(mock_sleep.call_args.args[0], 30)
+
+    @patch("scripts.utils.requests.Session.post")
+    def test_response_cache_reuses_successful_responses(self, mock_post):
+        from scripts.utils import enable_response_cache, fetch_data_with_retries
+
+        mock_post.return_value.content = b'{"data": {"ok": true}}'
+        mock_post.return_value.raise_for_status.return_value = None
+        with tempfile.TemporaryDirectory() as tmpdir:
+            enable_response_cache(tmpdir, 60)
+            try:
+                first = fetch_data_with_retries("query", {"eventId": 1, "page": 1})
+                second = fetch_data_with_retries("query", {"page": 1, "eventId": 1})
+                fetch_data_with_retries("query", {"eventId": 2, "page": 1})
+            finally:
+                enable_response_cache(None, 0)
+
+        self.assertEqual(first, {"data": {"ok": True}})
+        self.assertEqual(second, first)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch("scripts.utils.requests.Session.post")
+    def test_response_cache_ignores_embedded_before_date(self, mock_post):
+        from scripts.utils import enable_response_cache, fetch_data_with_retries
+
+        mock_post.return_value.content = b'{"data": {"ok": true}}'
+        mock_post.return_value.raise_for_status.return_value = None
+        with tempfile.TemporaryDirectory() as tmpdir:
+            enable_response_cache(tmpdir, 60)
+            try:
+                fetch_data_with_retries("query { t(beforeDate: 1700000000) }", {"page": 1})
+                fetch_data_with_retries("query { t(beforeDate: 1700000042) }", {"page": 1})
+            finally:
+                enable_response_cache(None, 0)
+
+        self.assertEqual(mock_post.call_count, 1)
+
+
+class WriteJsonRecordsTests(unittest.TestCase):
+    def tearDown(self):
+        set_indent_num(2)
+
+    def test_write_json_records_matches_json_dump_output(self):
+        records = [{"winner_id": 1, "details": [{"stage": "戦場"}]}, {"winner_id": 2, "details": []}]
+        for indent in (2, None):
+            for payload in (records, []):
+                set_indent_num(indent)
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    path = os.path.join(tmpdir, "matches.json")
+                    count = write_json_records(iter(payload), path, with_version=True)
+                    with open(path, encoding="utf-8") as fh:
+                        written = fh.read()
+
+                expected = json.dumps({"data": payload, "version": "1.0"}, indent=indent, ensure_ascii=False)
+                self.assertEqual(written, expected)
+                self.assertEqual(count, len(payload))
+
+    def test_write_json_records_indent_argument_overrides_module_setting(self):
+        records = [{"winner_id": 1}]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "matches.json")
+            write_json_records(iter(records), path, with_version=False, indent=None)
+            with open(path, encoding="utf-8") as fh:
+                written = fh.read()
+
+        self.assertEqual(written, json.dumps({"data": records}, ensure_ascii=False))
+
+
+class WriteJsonTests(unittest.TestCase):
+    def test_write_json_keeps_stdlib_float_formatting(self):
+        data = {"place": {"lat": 1e-07, "lng": 1e16, "postal_code": None}, "score": float("nan")}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "attr.json")
+            write_json(data, path, with_version=False, indent=2)
+            with open(path, encoding="utf-8") as fh:
+                written = fh.read()
+
+        self.assertEqual(written, json.dumps(data, indent=2, ensure_ascii=False))
+
+
+class TrackedWritesTests(unittest.TestCase):
+    def test_tracked_writes_are_waited_for_and_kept_out_of_the_global_queue(self):
+        from scripts.utils import submit_write, tracked_writes, wait_for_pending_writes
+
+        def fail():
+            raise OSError("disk full")
+
+        with tracked_writes() as writes:
+            submit_write(fail)
+
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].done())
+        self.assertIsInstance(writes[0].exception(), OSError)
+        # The failure was reported to the caller; the global wait does not re-raise it.
+        wait_for_pending_writes()
+
+
+class ReadUsersJsonlTests(unittest.TestCase):
+    def test_reads_line_per_record_and_concatenated_records(self):
+        contents = (
+            '{"user_id": 1, "gamer_tag": "あ", "version": "1.0"}\n\n{"user_id": 2, "discriminator": "x"}\n',
+            '{"user_id": 1, "gamer_tag": "あ", "version": "1.0"}{"user_id": 2,\n "discriminator": "x"}\n',
+        )
+        for content in contents:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "users.jsonl")
+                with open(path, "w", encoding="utf-8") as fh:
+                    fh.write(content)
+                users = read_users_jsonl(path)
+
+            self.assertEqual(
+                users,
+                {
+                    1: {"user_id": 1, "gamer_tag": "あ", "startgg_discriminator": None},
+                    2: {"user_id": 2, "startgg_discriminator": "x"},
+                },
+            )
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_acquire_waits_for_next_token(self):
+        clock = [100.0]
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        with patch("scripts.utils.time.monotonic", side_effect=lambda: clock[0]), patch(
+            "scripts.utils.time.sleep", side_effect=fake_sleep
+        ):
+            limiter = RateLimiter(60)
+            limiter.acquire()
+            limiter.acquire()
+            limiter.slow_down(10)
+            limiter.acquire()
+
+        self.assertEqual(len(sleeps), 2)
+        self.assertAlmostEqual(sleeps[0], 1.0)
+        self.assertAlmostEqual(sleeps[1], 2.0)
+
+    def test_exhausted_rate_limit_headers_block_until_reset(self):
+        clock = [100.0]
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        with patch("scripts.utils.time.monotonic", side_effect=lambda: clock[0]), patch(
+            "scripts.utils.time.sleep", side_effect=fake_sleep
+        ):
+            limiter = RateLimiter(60)
+            limiter.update_from_headers({"X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "30"})
+            limiter.acquire()
+            limiter.update_from_headers({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "30"})
+            limiter.acquire()
+
+        self.assertEqual(len(sleeps), 2)
+        self.assertAlmostEqual(sleeps[0], 30.0)
+        self.assertAlmostEqual(sleeps[1], 1.0)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
 import json
+import os
 import tempfile
 import unittest
 from pathlib import Path
 
-from scripts.fix.validate_data import validate_event_dir
+from scripts.fix.validate_data import validate_event_dir, validate_tournaments_file
 
 
 def write_json(path: Path, payload):
@@ -71,6 +72,36 @@ class ValidateDataTests(unittest.TestCase):
             self.assertEqual(errors, [])
             self.assertTrue(any("match IDs not in standings" in warn for warn in warnings))
 
+    def test_tournaments_file_reports_line_numbers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tournaments_file = Path(tmpdir) / "tournaments.jsonl"
+            missing_dir = Path(tmpdir) / "missing"
+            tournaments_file.write_text(
+                json.dumps({"events": [{"path": tmpdir}]})
+                + "\n\n{broken\n"
+                + json.dumps({"events": [{"path": str(missing_dir)}]}),
+                encoding="utf-8",
+            )
+            errors: list = []
+            validate_tournaments_file(tournaments_file, errors)
+            self.assertEqual(len(errors), 2)
+            self.assertTrue(errors[0].startswith(f"{tournaments_file}:3: invalid JSON"))
+            self.assertEqual(errors[1], f"{tournaments_file}:4: missing event dir {missing_dir}")
+
+    def test_tournaments_file_accepts_known_dirs_without_stat(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tournaments_file = Path(tmpdir) / "tournaments.jsonl"
+            known_dir = Path(tmpdir) / "events" / "known"
+            tournaments_file.write_text(
+                json.dumps({"events": [{"path": str(known_dir)}]}) + "\n",
+                encoding="utf-8",
+            )
+            errors: list = []
+            validate_tournaments_file(
+                tournaments_file, errors, frozenset({os.path.abspath(known_dir)})
+            )
+            self.assertEqual(errors, [])
+
 
 if __name__ == "__main__":
     unittest.main()
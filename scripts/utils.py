@@ -1,101 +1,280 @@
 import time
 import os
 import json
+import hashlib
+import itertools
 import csv
+import io
 import sys
 import random
+import re
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # orjson は任意。無ければ標準の json を使う
+    orjson = None
+
+# 国コード -> リージョンの対応表 (呼び出し毎にリストを作らないようにモジュールで1回だけ作る)
+_REGION_COUNTRY_CODES = {
+    "Japan": ("JP",),
+    "Other Asia": ("CN", "KR", "IN", "SG", "TH", "MY", "PH", "VN", "ID"),
+    "Europe": ("FR", "DE", "GB", "IT", "ES", "RU", "NL", "SE", "CH", "BE"),
+    "North America": ("US", "CA", "DO", "MX"),
+}
+_COUNTRY_CODE_TO_REGION = {
+    country_code: region
+    for region, country_codes in _REGION_COUNTRY_CODES.items()
+    for country_code in country_codes
+}
 
 # 国コードをリージョンに変換する関数
 def country_code2region(country_code):
-    japan = ["JP"]
-    other_asia = ["CN", "KR", "IN", "SG", "TH", "MY", "PH", "VN", "ID"]
-    europe = ["FR", "DE", "GB", "IT", "ES", "RU", "NL", "SE", "CH", "BE"]
-    north_america = ["US", "CA", "DO", "MX"]
-
-    if country_code in japan:
-        return "Japan"
-    elif country_code in other_asia:
-        return "Other Asia"
-    elif country_code in europe:
-        return "Europe"
-    elif country_code in north_america:
-        return "North America"
-    else:
-        return "Other"
+    return _COUNTRY_CODE_TO_REGION.get(country_code, "Other")
+
 
+@lru_cache(maxsize=4096)
+def __date_parts(date):
+    # 同じタイムスタンプが繰り返し渡されるのでキャッシュし、gmtime も1回だけ呼ぶ
+    tm = time.gmtime(date)
+    return f"{tm.tm_year:04d}", f"{tm.tm_mon:02d}", f"{tm.tm_mday:02d}"
 
 def get_date_parts(date):
     """日付を年、月、日に分割する関数"""
-    year = time.strftime("%Y", time.gmtime(date))
-    month = time.strftime("%m", time.gmtime(date))
-    day = time.strftime("%d", time.gmtime(date))
-    return year, month, day
+    if date is None:
+        # gmtime(None) は現在時刻を使うので、None をキーにキャッシュしないよう現在時刻を渡す
+        date = int(time.time())
+    return __date_parts(date)
 
+# パスに使えるよう空白を "_"、"/" を "-" に置き換える変換表
+_PATH_SAFE_TABLE = str.maketrans({" ": "_", "/": "-"})
+
+@lru_cache(maxsize=8192)
 def get_event_directory(startgg_dir, region, year, month, day, tournament_name, event_name):
-    """保存するディレクトリのパスを取得する関数"""
-    region = country_code2region(region)
-    region = region.replace(" ", "_").replace("/", "-")
-    tournament_name = tournament_name.replace(" ", "_").replace("/", "-")
-    event_name = event_name.replace(" ", "_").replace("/", "-")
+    """保存するディレクトリのパスを取得する関数 (引数はすべて文字列なので結果をキャッシュする)"""
+    region = country_code2region(region).translate(_PATH_SAFE_TABLE)
+    tournament_name = tournament_name.translate(_PATH_SAFE_TABLE)
+    event_name = event_name.translate(_PATH_SAFE_TABLE)
     return f"{startgg_dir}/{region}/{year}/{month}/{day}/{tournament_name}/{event_name}"
 
 
 JSON_VERSION = "1.0"
 __indent_num = 2
-
-def write_json(data, file_path, with_version):
+__jsonl_flush_every = 1024  # write_jsonl で一度に書き込む行数
+
+def __contains_float(data):
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            return True
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return False
+
+def dumps_json(data, indent):
+    """JSON を UTF-8 の bytes にする関数 (indent が 2 なら orjson を使う)
+
+    orjson は 2 スペースのインデントしか出力できないため、それ以外は標準の json を使う。
+    また orjson は 1e-07 を 1e-7、NaN を null と書くなど float の表記が標準の json と
+    異なるので、float を含むデータ (attr.json の緯度経度など) も標準の json に任せる。
+    """
+    if orjson is not None and indent == 2 and not __contains_float(data):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # 64bit を超える整数など、orjson が扱えない値は標準の json に任せる
+    return json.dumps(data, indent=indent, ensure_ascii=False).encode("utf-8")
+
+# indent を省略したときに set_indent_num の値を使うことを表す目印 (None は「インデントなし」)
+__use_indent_num = object()
+
+def write_json(data, file_path, with_version, indent=__use_indent_num):
+    if indent is __use_indent_num:
+        indent = __indent_num
+    if with_version:
+        data["version"] = JSON_VERSION
+    # json.dump はチャンクごとに write を呼ぶので、bytes にしてから1回で書き込む
+    with open(file_path, "wb") as f:
+        f.write(dumps_json(data, indent))
+
+def write_json_records(records, file_path, with_version, key="data", indent=__use_indent_num):
+    """{key: [...]} 形式の JSON を、リストを溜め込まずに1件ずつ書き出す関数"""
+    if indent is __use_indent_num:
+        indent = __indent_num
+    if indent is None:
+        outer, inner, separator = "", "", ", "
+    else:
+        indent_text = " " * indent if isinstance(indent, int) else indent
+        outer, inner, separator = "\n" + indent_text, "\n" + indent_text * 2, ","
+    count = 0
     with open(file_path, "w", encoding="utf-8") as f:
+        f.write("{" + outer + json.dumps(key) + ": [")
+        for record in records:
+            if count:
+                f.write(separator)
+            f.write(inner + json.dumps(record, indent=indent, ensure_ascii=False).replace("\n", inner))
+            count += 1
+        if count:
+            f.write(outer)
+        f.write("]")
         if with_version:
-            data["version"] = JSON_VERSION
-        json.dump(data, f, indent=__indent_num, ensure_ascii=False)
+            f.write(separator + outer + '"version": ' + json.dumps(JSON_VERSION))
+        f.write(outer[:1] + "}")
+    return count
+
+__write_executor = None
+__pending_writes = []
+__pending_writes_lock = threading.Lock()
+__write_scope = threading.local()
+
+def submit_write(func, *args, **kwargs):
+    """ファイル書き込みをバックグラウンドのスレッドで実行する関数"""
+    global __write_executor
+    with __pending_writes_lock:
+        if __write_executor is None:
+            __write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="json-writer")
+        future = __write_executor.submit(func, *args, **kwargs)
+        # tracked_writes の中ならそのブロックで待つので、全体の待ち行列には入れない
+        scope = getattr(__write_scope, "futures", None)
+        (__pending_writes if scope is None else scope).append(future)
+    return future
+
+def wait_for_pending_writes():
+    """submit_write で投入した書き込みの完了を待つ関数"""
+    with __pending_writes_lock:
+        pending = __pending_writes[:]
+        __pending_writes.clear()
+    for future in pending:
+        future.result()
+
+@contextmanager
+def tracked_writes():
+    """with ブロック内でこのスレッドが submit_write した書き込みを、ブロックを抜けるときに待つ
+
+    as で受け取った future のリストで、呼び出し側が書き込みの成否を確認する。
+    """
+    futures = []
+    previous = getattr(__write_scope, "futures", None)
+    __write_scope.futures = futures
+    try:
+        yield futures
+    finally:
+        __write_scope.futures = previous
+        wait_futures(futures)
+
+def loads_json(data):
+    """bytes / str の JSON をデコードする関数 (orjson があればそちらを使う)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 def read_json(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(file_path, "rb") as f:
+        return loads_json(f.read())
+
+# json.dumps にキーワード引数を渡すと毎回 JSONEncoder を作り直すので、1つを使い回す
+_jsonl_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+def __write_jsonl_lines(f, data, with_version):
+    # 1件ごとに write せず、__jsonl_flush_every 件ずつまとめて書き込む
+    encode = _jsonl_encode
+    lines = []
+    for d in data:
+        if with_version:
+            d["version"] = JSON_VERSION
+        lines.append(encode(d))
+        if len(lines) >= __jsonl_flush_every:
+            lines.append("")
+            f.write("\n".join(lines))
+            lines = []
+    if lines:
+        lines.append("")
+        f.write("\n".join(lines))
 
 def write_jsonl(data, file_path, with_version):
-    with open(file_path, "w", encoding="utf-8") as f:
-        for d in data:
-            if with_version:
-                d["version"] = JSON_VERSION
-            json.dump(d, f, ensure_ascii=False)
-            f.write("\n")
+    # data はリストでなくイテレータでもよい (全件をメモリに載せない)
+    # 一時ファイルに書いてから置き換え、途中で落ちても元のファイルを壊さない
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        __write_jsonl_lines(f, data, with_version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+def write_text_atomic(text, file_path):
+    """一時ファイル経由で os.replace し、書きかけのファイルを残さない関数"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
 
 def extend_jsonl(data, file_path, with_version):
     with open(file_path, "a", encoding="utf-8") as f:
-        for d in data:
-            if with_version:
-                d["version"] = JSON_VERSION
-            json.dump(d, f, ensure_ascii=False)
-            f.write("\n")
+        __write_jsonl_lines(f, data, with_version)
 
-def _read_json_records(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
+def _iter_json_records(f):
+    """バイナリで開いた JSON 配列 / JSONL / 連結 JSON のファイルからレコードを1件ずつ返すジェネレータ
 
-    if not text.strip():
-        return []
+    JSONL はファイル全体を読み込まずに1行ずつデコードする。
+    """
+    for first_line in f:
+        if first_line.strip():
+            break
+    else:
+        return
 
-    stripped = text.lstrip()
-    if stripped.startswith("["):
-        records = json.loads(text)
+    if first_line.lstrip().startswith(b"["):
+        records = loads_json(first_line + f.read())
         if not isinstance(records, list):
-            raise ValueError(f"{file_path} must contain a JSON array when JSON format is used.")
-        return records
+            raise ValueError(f"{f.name} must contain a JSON array when JSON format is used.")
+        yield from records
+        return
 
-    records = []
     decoder = json.JSONDecoder()
-    index = 0
-    length = len(text)
-    while index < length:
-        while index < length and text[index].isspace():
-            index += 1
-        if index >= length:
-            break
-        record, index = decoder.raw_decode(text, index)
-        records.append(record)
-    return records
+    pending = ""
+    for line in itertools.chain((first_line,), f):
+        if not pending:
+            if not line.strip():
+                continue
+            # 1行1レコードならば行単位で loads_json (orjson) を使う
+            try:
+                yield loads_json(line)
+                continue
+            except ValueError:
+                pass
+        # 1行に複数レコードがある/複数行にまたがる場合は、溜めた行から raw_decode で取り出す
+        pending += line.decode("utf-8")
+        index = 0
+        length = len(pending)
+        while True:
+            while index < length and pending[index].isspace():
+                index += 1
+            if index >= length:
+                break
+            try:
+                record, index = decoder.raw_decode(pending, index)
+            except ValueError:
+                break
+            yield record
+        pending = pending[index:]
+
+    if pending.strip():
+        # 最後まで読んでもデコードできなかった部分はエラーにする
+        decoder.raw_decode(pending.lstrip())
+
+def _read_json_records(file_path):
+    with open(file_path, "rb") as f:
+        return list(_iter_json_records(f))
 
 def read_jsonl(file_path):
     return _read_json_records(file_path)
@@ -104,93 +283,252 @@ def set_indent_num(num):
     global __indent_num
     __indent_num = num
 
-def read_users_jsonl(file_path):
-    if not os.path.exists(file_path):
+def __read_indexed_jsonl(file_path, key, normalize=None):
+    """JSONL を読み込み、key の値をキーにした辞書を返す (version は落とす)"""
+    # exists で確認してから開くと stat が2回になるので、開けなければ空として扱う
+    try:
+        f = open(file_path, "rb")
+    except FileNotFoundError:
         return {}
-    users = {}
-    for user in _read_json_records(file_path):
-        if not isinstance(user, dict):
-            continue
-        if "user_id" not in user:
-            continue
-        user.pop("version", None)
-        if "startgg_discriminator" not in user:
-            user["startgg_discriminator"] = user.get("discriminator")
-        user.pop("discriminator", None)
-        users[user["user_id"]] = user
-    return users
-    
+    records = {}
+    with f:
+        for record in _iter_json_records(f):
+            if not isinstance(record, dict) or key not in record:
+                continue
+            record.pop("version", None)
+            if normalize is not None:
+                normalize(record)
+            records[record[key]] = record
+    return records
+
+def __normalize_user(user):
+    if "startgg_discriminator" not in user:
+        user["startgg_discriminator"] = user.get("discriminator")
+    user.pop("discriminator", None)
+
+def read_users_jsonl(file_path):
+    return __read_indexed_jsonl(file_path, "user_id", __normalize_user)
+
 def read_tournaments_jsonl(file_path):
-    if not os.path.exists(file_path):
-        return {}
-    tournaments = {}
-    for tournament in _read_json_records(file_path):
-        if not isinstance(tournament, dict):
-            continue
-        if "tournament_id" not in tournament:
-            continue
-        tournament.pop("version", None)
-        tournaments[tournament["tournament_id"]] = tournament
-    return tournaments
+    return __read_indexed_jsonl(file_path, "tournament_id")
 
 def read_csv(file_path):
-    if not os.path.exists(file_path):
+    try:
+        with open(file_path, "r") as f:
+            text = f.read()
+    except FileNotFoundError:
         return {}
-    with open(file_path, "r") as f:
-        data = {}
-        for row in csv.reader(f):
-            id = row[0]
-            if len(row) == 2:
-                data[id] = row[1]
-            else:
-                data[id] = tuple(row[1:])
-        return data
-    
+    # 引用符を含まない2列の CSV (id,path など) は csv モジュールを通さず split で読む
+    if '"' not in text:
+        lines = text.split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        try:
+            return dict(line.split(",") for line in lines)
+        except ValueError:
+            pass  # 2列でない行がある
+    # 引用符がある場合や2列でない行がある場合は csv.reader で1行ずつ処理する
+    data = {}
+    for row in csv.reader(io.StringIO(text)):
+        id = row[0]
+        if len(row) == 2:
+            data[id] = row[1]
+        else:
+            data[id] = tuple(row[1:])
+    return data
+
 def read_set(file_path, as_int):
-    if not os.path.exists(file_path):
+    # 1行ずつ読まずに全体を読み込んで分割する (末尾の改行の後ろは行として数えない)
+    try:
+        with open(file_path, "r") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
         return set()
-    with open(file_path, "r") as f:
-        if as_int:
-            return set(int(line.strip()) for line in f)
-        else:
-            return set(line.strip() for line in f)
+    if lines[-1] == "":
+        lines.pop()
+    lines = map(str.strip, lines)
+    if as_int:
+        return set(map(int, lines))
+    return set(lines)
 
 # イベントパス情報を保存する関数
 def write_event_paths(event_paths, file_path):
     with open(file_path, "w", newline='') as f:
-        writer = csv.writer(f)
-        for event_id, (date, path) in event_paths.items():
-            writer.writerow([event_id, date, path])
+        csv.writer(f).writerows((event_id, date, path) for event_id, (date, path) in event_paths.items())
 
 # IDパス情報を保存する関数
 def write_id_paths(id_paths, file_path):
     # ディレクトリが存在しない場合は作成
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     with open(file_path, "w", newline='') as f:
-        writer = csv.writer(f)
-        for id, path in id_paths.items():
-            writer.writerow([id, path])
+        csv.writer(f).writerows(id_paths.items())
             
 class FetchError(Exception):
+    # 生成時には出力しない (メッセージは捕捉した側で表示する)
     def __init__(self, message):
         super().__init__(message)
-        print(message, file=sys.stderr)
 
 class NoPhaseError(Exception):
     def __init__(self, message):
         super().__init__(message)
 
+class RateLimiter:
+    """トークンバケット方式で1分あたりのリクエスト数を制限するクラス"""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.base_rate = rate_per_minute / 60.0
+        self.rate = self.base_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.cooldown_until = None
+        self.blocked_until = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = self._next_wait(time.monotonic())
+                if wait is None:
+                    return
+            time.sleep(wait)
+
+    def _next_wait(self, now):
+        # トークンを取れたら None、取れなければ待つべき秒数を返す (lock を持った状態で呼ぶ)
+        if self.blocked_until is not None:
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.blocked_until = None
+            self.tokens = 0.0
+            self.updated_at = now
+        if self.cooldown_until is not None and now >= self.cooldown_until:
+            self.rate = self.base_rate
+            self.cooldown_until = None
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+    def update_from_headers(self, headers):
+        """X-RateLimit-Remaining / X-RateLimit-Reset ヘッダに合わせて待ち時間を決める
+
+        残りが 0 になったら、Reset (エポック秒または残り秒数) までトークンを出さない。
+        """
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = float(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+        if remaining > 0:
+            return
+        if reset > 1e9:
+            reset -= time.time()
+        if reset <= 0:
+            return
+        with self.lock:
+            blocked_until = time.monotonic() + reset
+            if self.blocked_until is None or blocked_until > self.blocked_until:
+                self.blocked_until = blocked_until
+
+    def slow_down(self, cooldown):
+        """レート制限を受けたときに、cooldown 秒間レートを半分に落とす"""
+        with self.lock:
+            self.rate = max(self.rate / 2, self.base_rate / 16)
+            self.tokens = 0.0
+            self.updated_at = time.monotonic()
+            self.cooldown_until = self.updated_at + cooldown
+
 __max_retries = 100
 __retry_delay = 5
 __page_delay = 2
+__page_prefetch = 1
 __request_timeout = 60
 __api_url = "https://api.start.gg/gql/alpha"
 __headers = {}
 
+def __create_session(pool_size):
+    # api.start.gg への接続を使い回し、リクエスト毎の TCP/TLS ハンドシェイクを避ける
+    # 認証ヘッダはセッションに持たせ、リクエスト毎に dict を渡さない
+    session = requests.Session()
+    session.headers.update(__headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+__session = __create_session(10)
+
+__rate_limiter = None
+
+def set_rate_limiter(limiter):
+    """fetch_data_with_retries のレスポンスヘッダを渡す RateLimiter を設定する関数 (None で解除)"""
+    global __rate_limiter
+    __rate_limiter = limiter
+
+__response_cache_dir = None
+__response_cache_ttl = 0
+
+def enable_response_cache(cache_dir, ttl_seconds):
+    """GraphQL のレスポンスを cache_dir に保存し、ttl_seconds 秒以内なら再利用する関数
+
+    cache_dir に None を渡すとキャッシュを無効にする。
+    """
+    global __response_cache_dir, __response_cache_ttl
+    __response_cache_dir = cache_dir
+    __response_cache_ttl = ttl_seconds
+
+# クエリに埋め込まれた実行時刻 (get_tournaments_by_game_query の beforeDate) は呼ぶたびに変わる
+_VOLATILE_QUERY_ARGS = re.compile(r"beforeDate:\s*\d+")
+
+def __response_cache_path(query, variables):
+    # URL・クエリ・変数の内容からキーを作る (変数はキー順を揃える)
+    # 実行時刻はキーから除き、鮮度は TTL で判断する
+    query = _VOLATILE_QUERY_ARGS.sub("beforeDate", query)
+    key_source = "\n".join((__api_url, query, json.dumps(variables, sort_keys=True)))
+    key = hashlib.sha1(key_source.encode("utf-8")).hexdigest()
+    return os.path.join(__response_cache_dir, key[:2], f"{key}.json")
+
+def __read_cached_response(cache_path):
+    try:
+        if time.time() - os.stat(cache_path).st_mtime > __response_cache_ttl:
+            return None
+        with open(cache_path, "rb") as f:
+            return loads_json(f.read())
+    except (OSError, ValueError):
+        return None
+
+def __write_cached_response(cache_path, content):
+    # キャッシュは補助的なものなので、書けなくても取得処理は続ける
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Failed to write response cache {cache_path}: {e}", file=sys.stderr)
+
+def set_connection_pool_size(pool_size):
+    """並列実行数に合わせて接続プールの大きさを変える関数"""
+    global __session
+    __session.close()
+    __session = __create_session(max(1, pool_size))
+
 def set_page_delay(delay):
     global __page_delay
     __page_delay = delay
 
+def set_page_prefetch(num):
+    """fetch_all_nodes で同時に取得するページ数を設定する関数 (1 なら逐次取得)"""
+    global __page_prefetch
+    __page_prefetch = max(1, num)
+
 def set_retry_parameters(max_retries, retry_delay):
     global __max_retries, __retry_delay
     __max_retries = max_retries
@@ -207,23 +545,56 @@ def set_api_parameters(url, token):
         "Content-Type": "application/json",
         "Authorization": "Bearer " + token,
     }
+    __session.headers.update(__headers)
+
+__max_retry_wait = 60
+
+def __retry_wait(attempt, retry_after):
+    # 429 / 5xx は指数バックオフ (上限 __max_retry_wait 秒)。Retry-After があればそれ以上待つ
+    wait = min(__retry_delay * 2 ** min(attempt, 16), max(__max_retry_wait, __retry_delay))
+    if retry_after:
+        try:
+            wait = max(wait, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date 形式は扱わず、バックオフの値を使う
+    return wait
+
+@lru_cache(maxsize=64)
+def __query_payload_prefix(query):
+    # クエリは定数なので、エスケープ済みの '{"query": ..., "variables": ' を使い回す
+    return b'{"query": ' + json.dumps(query).encode("utf-8") + b', "variables": '
+
+def __encode_payload(query, variables):
+    # Content-Type: application/json はセッションのヘッダに設定済み
+    return __query_payload_prefix(query) + json.dumps(variables).encode("utf-8") + b"}"
 
 def fetch_data_with_retries(query, variables):
+    cache_path = None
+    if __response_cache_dir is not None:
+        cache_path = __response_cache_path(query, variables)
+        cached = __read_cached_response(cache_path)
+        if cached is not None:
+            return cached
     status_code = None
     last_error_message = ""
+    payload = __encode_payload(query, variables)
     for attempt in range(__max_retries):
         try:
             print(
                 f"Requesting start.gg data: page={variables.get('page', 1)} per_page={variables.get('perPage')} keys={sorted(variables.keys())}"
             )
-            response = requests.post(
+            response = __session.post(
                 __api_url,
-                json={"query": query, "variables": json.dumps(variables)},
-                headers=__headers,
+                data=payload,
                 timeout=__request_timeout,
             )
+            if __rate_limiter is not None:
+                __rate_limiter.update_from_headers(response.headers)
             response.raise_for_status()
-            response_data = json.loads(response.text)
+            response_data = loads_json(response.content)
+            # GraphQL のエラーを含むレスポンスはキャッシュしない
+            if cache_path is not None and "errors" not in response_data:
+                __write_cached_response(cache_path, response.content)
             return response_data
         except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
             print(query)
@@ -231,14 +602,13 @@ def fetch_data_with_retries(query, variables):
             last_error_message = str(e)
             wait = __retry_delay
             status_code = None
-            if isinstance(e, requests.exceptions.HTTPError):
-                status_code = e.response.status_code if e.response is not None else None
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+                status_code = e.response.status_code
+                if status_code == 429 or status_code >= 500:
+                    wait = __retry_wait(attempt, e.response.headers.get("Retry-After"))
                 if status_code == 429:
-                    wait = max(__retry_delay * (attempt + 1), __retry_delay)
                     last_error_message = "Too Many Requests"
                     print(f"Received HTTP 429 Too Many Requests. Waiting {wait} seconds before retrying...", file=sys.stderr)
-                elif status_code is not None and status_code >= 500:
-                    wait = __retry_delay * (attempt + 1)
             jitter = random.uniform(0, max(1.0, wait * 0.1))
             wait += jitter
             print(f"Request or JSON parsing failed: {e}. Retrying {attempt + 1}/{__max_retries} after {wait:.2f} seconds...")
@@ -246,6 +616,40 @@ def fetch_data_with_retries(query, variables):
     status_message = f"Max retries exceeded for query. Last status code: {status_code}. Last error: {last_error_message}"
     raise FetchError(status_message)
 
+def __page_data(response_data, query, variables, keys):
+    data = response_data
+    for key in keys:
+        if key not in data:
+            raise FetchError(f"Error: '{key}' key not found in response. Query: {query}\nVariables: {variables}\nKeys: {keys}\nResponse data: {response_data}\n in fetch_all_nodes")
+        data = data[key]
+    if data is None or "nodes" not in data:
+        raise FetchError(f"Error: 'nodes' key not found in response. Query: {query}\nVariables: {variables}\nKeys: {keys}\nResponse data: {response_data}\n in fetch_all_nodes")
+    return data
+
+def __fetch_remaining_pages(query, variables, keys, total_pages):
+    """2ページ目以降を __page_prefetch 並列で取得し、ページ順のノードのリストを返す関数
+
+    リクエストの開始間隔は逐次取得と同じく __page_delay 秒以上空ける。
+    """
+    limiter = RateLimiter(60.0 / __page_delay) if __page_delay > 0 else None
+
+    def fetch_page(page):
+        if limiter is not None:
+            limiter.acquire()
+        page_variables = dict(variables, page=page)
+        return __page_data(fetch_data_with_retries(query, page_variables), query, page_variables, keys)["nodes"]
+
+    if limiter is not None:
+        limiter.acquire()  # 1ページ目の直後にすぐ次を投げないよう、最初のトークンを使っておく
+    with ThreadPoolExecutor(max_workers=__page_prefetch) as executor:
+        futures = [executor.submit(fetch_page, page) for page in range(2, total_pages + 1)]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
 def fetch_all_nodes(query, variables, keys, per_page=10):
     all_nodes = []
     variables = variables.copy()
@@ -254,13 +658,7 @@ def fetch_all_nodes(query, variables, keys, per_page=10):
     keys = ["data"] + keys
     while True:
         response_data = fetch_data_with_retries(query, variables)
-        data = response_data
-        for key in keys:
-            if key not in data:
-                raise FetchError(f"Error: '{key}' key not found in response. Query: {query}\nVariables: {variables}\nKeys: {keys}\nResponse data: {response_data}\n in fetch_all_nodes")
-            data = data[key]
-        if data is None or "nodes" not in data:
-            raise FetchError(f"Error: 'nodes' key not found in response. Query: {query}\nVariables: {variables}\nKeys: {keys}\nResponse data: {response_data}\n in fetch_all_nodes")
+        data = __page_data(response_data, query, variables, keys)
         nodes = data["nodes"]
         all_nodes.extend(nodes)
         page_info = data.get("pageInfo") if isinstance(data, dict) else None
@@ -270,6 +668,11 @@ def fetch_all_nodes(query, variables, keys, per_page=10):
         if total_pages is not None:
             if current_page >= total_pages:
                 break
+            if __page_prefetch > 1 and current_page == 1:
+                # ページ数が分かっているので残りのページはまとめて先読みする
+                for page_nodes in __fetch_remaining_pages(query, variables, keys, total_pages):
+                    all_nodes.extend(page_nodes)
+                break
             variables["page"] += 1
             time.sleep(__page_delay)
             continue